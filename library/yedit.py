@@ -39,6 +39,99 @@ options:
     - The file that is the target of the modifications.
     required: false
     aliases: []
+  paths:
+    description:
+    - A list of files or glob patterns, expanded on the target, to apply the
+    - same key, value or edits to.  Mutually exclusive with src.
+    - Files are processed in parallel and the result holds one entry per
+    - file in C(results) plus C(changed_count) and C(failed_count).  The task
+    - fails when a pattern matches no file.
+    required: false
+    aliases: []
+  document:
+    description:
+    - Selects one document of a multi-document yaml file, either by its
+    - index or by a predicate of comma separated key=value pairs, for
+    - example C(kind=Deployment,metadata.name=foo).  The first matching
+    - document is the one read and edited, all other documents are written
+    - back byte-for-byte.
+    required: false
+    aliases: []
+  path_index:
+    description:
+    - With state=list and a key, keep a sidecar index next to src
+    - (C(<src>.yedit_index)) that maps key paths to the byte range of their
+    - values, so lookups only parse that fragment of the file.  The index is
+    - rebuilt automatically when the file changes.  Hit and miss counters are
+    - returned as C(path_index).
+    required: false
+    default: false
+    type: bool
+    aliases: []
+  path_index_depth:
+    description:
+    - The deepest key path stored in the index.
+    required: false
+    default: 3
+    aliases: []
+  path_index_max_entries:
+    description:
+    - The maximum number of key paths stored in the index.  Shallower paths
+    - are kept first.
+    required: false
+    default: 10000
+    aliases: []
+  expected_checksum:
+    description:
+    - The sha1 checksum src must have for the change to be made, as returned
+    - in C(checksum) by a previous run or by the stat module.  When src was
+    - changed by someone else, the task fails instead of making the change.
+    required: false
+    default: null
+    aliases: []
+  retries:
+    description:
+    - How many times edits are loaded and applied again when src is replaced
+    - by another writer between loading and writing it.  From the first retry
+    - on, the task holds the lock writers take on src before replacing it, so
+    - other yedit tasks cannot get in again.  The number of conflicts is
+    - returned as C(conflicts).
+    required: false
+    default: 3
+    aliases: []
+  lock:
+    description:
+    - Hold an exclusive lock on C(<src>.yedit_lock) while src is loaded, edited
+    - and written, so concurrent tasks on the same file wait for each other.
+    - How long the lock was waited for and how many attempts it took are
+    - returned as C(lock).
+    required: false
+    default: false
+    type: bool
+    aliases: []
+  lock_timeout:
+    description:
+    - How many seconds to wait for the lock before failing.
+    required: false
+    default: 30
+    aliases: []
+  journal:
+    description:
+    - With state=present and a key and value, or edits, without append or
+    - insert, record the hash of src after the run in a sidecar file
+    - (C(<src>.yedit_journal)).  When the same edits run again on a file with
+    - that hash, nothing is parsed and C(changed) is false.  Whether the
+    - journal was used is returned as C(journal).
+    required: false
+    default: false
+    type: bool
+    aliases: []
+  workers:
+    description:
+    - The maximum number of worker processes used with paths.  Defaults to
+    - the number of CPUs.
+    required: false
+    aliases: []
   content:
     description:
     - Content represents the yaml content you desire to work with.  This
@@ -55,10 +148,26 @@ options:
   key:
     description:
     - The path to the value you wish to modify. Emtpy string means the top of
-    - the document.
+    - the document.  List items are selected by position, C(a.b[0]), or by
+    - the value of one of their fields, C(spec.containers[name=app].image).
+    - The value matches the field as text or as the yaml scalar it reads as,
+    - so C([enabled=true]) also selects items whose field is the boolean true.
+    - C(*) or C([*]) matches every item of a dict or list and a doubled
+    - separator any number of levels, C(a.*.image) or C(spec..image). Such
+    - keys can be listed, returning the list of the matched values, or put,
+    - setting the value at every match.
     required: false
     default: ''
     aliases: []
+  query:
+    description:
+    - With state=list, a JMESPath expression run against the value at key,
+    - or the whole document, and returned instead of it.  Fields, indexes,
+    - slices, projections, filters, multi-selects and pipes are supported,
+    - functions are not.
+    required: false
+    default: None
+    aliases: []
   value:
     description:
     - The incoming value of parameter 'key'.
@@ -89,6 +198,9 @@ options:
     - Whether to append to an array/list. When the key does not exist or is
     - null, a new array is created. When the key is of a non-list type,
     - nothing is done.
+    - When the list is the last block of src, under a top level key or as the
+    - root of the document, the item is appended to the file without loading
+    - it (engine C(append)) and the edit result does not include the document.
     required: false
     default: false
     aliases: []
@@ -102,6 +214,30 @@ options:
     default: false
     aliases: []
     type: bool
+  extend:
+    description:
+    - Whether to append each item of the list value to an array/list. When
+    - the key does not exist or is null, a new array is created.
+    required: false
+    default: false
+    aliases: []
+    type: bool
+  extend_unique:
+    description:
+    - Like extend, but only the items the array/list does not hold yet are
+    - appended, in the order of the value.
+    required: false
+    default: false
+    aliases: []
+    type: bool
+  remove_many:
+    description:
+    - Whether to remove every item of an array/list equal to one of the items
+    - of the list value.
+    required: false
+    default: false
+    aliases: []
+    type: bool
   index:
     description:
     - Used in conjunction with the update or insert parameter.  This will update / insert to a
@@ -141,6 +277,48 @@ options:
     required: false
     default: '.'
     aliases: []
+  durability:
+    description:
+    - How hard to try to get a written file onto disk.
+    - C(full) fsyncs the file and its directory.
+    - C(data) fsyncs only the file.
+    - C(batch) defers the fsyncs to the end of the module run and fsyncs
+    - every directory once, however many files were written to it.
+    - C(none) leaves flushing to the operating system.
+    - The applied mode is returned as C(durability).
+    required: false
+    default: full
+    choices: ['full', 'data', 'batch', 'none']
+    aliases: []
+  preserve_format:
+    description:
+    - Whether comments, key order and formatting of yaml files are preserved.
+    - When false, the file is loaded and dumped with the libyaml backed safe
+    - loader and dumper when available, which is many times faster for large
+    - machine generated files.  Keys are written sorted.
+    - The engine used is returned as C(engine).  When only scalar values were
+    - changed, they are replaced in the original text and the rest of the file
+    - is written back untouched (engine C(patch)).
+    required: false
+    default: true
+    type: bool
+    aliases: []
+  cache_dir:
+    description:
+    - A directory to cache parsed yaml files in, keyed by the hash of their
+    - contents, so files shared by many runs are parsed once.  Hits and misses
+    - are returned as C(cache).  Only cache entries owned by the current user
+    - are read.
+    required: false
+    default: null
+    aliases: []
+  cache_size:
+    description:
+    - The total size in bytes the cache may use.  The least recently used
+    - entries are removed past it.
+    required: false
+    default: 104857600
+    aliases: []
 author:
 - "Kenny Woodson <kwoodson@redhat.com>"
 extends_documentation_fragment: []
@@ -169,6 +347,54 @@ EXAMPLES = '''
 #   b:
 #     c: d
 #
+# edit one document of a multi-document file
+- name: scale the foo deployment in a manifest bundle
+  yedit:
+    src: bundle.yml
+    document: kind=Deployment,metadata.name=foo
+    key: spec.replicas
+    value: 3
+#
+# edit the list item with a given field value
+- name: update the image of the app container
+  yedit:
+    src: deployment.yml
+    key: spec.template.spec.containers[name=app].image
+    value: registry/app:2.0
+#
+# read only the names of the containers that expose a port
+- name: list the serving containers
+  yedit:
+    src: deployment.yml
+    key: spec.template.spec.containers
+    query: "[?ports].name"
+    state: list
+#
+# set the image of every container in one edit
+- name: pin every image
+  yedit:
+    src: deployment.yml
+    key: spec.template.spec.containers[*].image
+    value: registry/app:2.0
+#
+# add many items to a list, skipping the ones it already holds
+- name: allow the office networks
+  yedit:
+    src: firewall.yml
+    key: allow
+    value:
+    - 10.1.0.0/16
+    - 10.2.0.0/16
+    extend_unique: true
+#
+# the same edit on many files
+- name: set the log level in every service config
+  yedit:
+    paths:
+    - /etc/services/*.yml
+    key: logging.level
+    value: info
+#
 # multiple edits at the same time
 - name: perform multiple edits
   yedit:
@@ -186,10 +412,21 @@ EXAMPLES = '''
 #       d: e
 '''
 
+import codecs  # noqa: F401
+import collections  # noqa: F401
 import copy  # noqa: F401
+import datetime  # noqa: F401
+import errno  # noqa: F401
 import fcntl  # noqa: F401
+import glob  # noqa: F401
+import hashlib  # noqa: F401
+import io  # noqa: F401
 import json   # noqa: F401
+import locale  # noqa: F401
+import multiprocessing  # noqa: F401
 import os  # noqa: F401
+import pickle  # noqa: F401
+import random  # noqa: F401
 import re  # noqa: F401
 import shutil  # noqa: F401
 import time  # noqa: F401
@@ -201,18 +438,53 @@ except ImportError:
 
 from ansible.module_utils.basic import AnsibleModule
 
+# Loader and dumper of the fast engine, backed by libyaml when available
+try:
+    FAST_LOADER, FAST_DUMPER, FAST_ENGINE = yaml.CSafeLoader, yaml.CSafeDumper, 'libyaml'
+except AttributeError:
+    FAST_LOADER, FAST_DUMPER, FAST_ENGINE = yaml.SafeLoader, yaml.SafeDumper, 'safe'
+
 
 class YeditException(Exception):
     ''' Exception class for Yedit '''
     pass
 
 
+class YeditConflict(YeditException):
+    ''' The file changed on disk after it was loaded '''
+    pass
+
+
 # pylint: disable=too-many-public-methods,too-many-instance-attributes
 class Yedit(object):
     ''' Class to modify yaml files '''
-    re_valid_key = r"(((\[-?\d+\])|([0-9a-zA-Z%s/_-]+)).?)+$"
-    re_key = r"(?:\[(-?\d+)\])|([0-9a-zA-Z{}/_-]+)"
+    re_valid_key = r"(((\[(-?\d+|\*)\])|(\[[0-9a-zA-Z%s/_-]+=[^\]]*\])|([0-9a-zA-Z%s/_-]+|\*)).?)+$"
+    re_key = r"(?:\[(-?\d+|\*)\])|(?:\[([0-9a-zA-Z{0}/_-]+)=([^\]]*)\])|([0-9a-zA-Z{0}/_-]+|\*)"
+    # wildcard segments of compiled keys: any child, and any number of levels
+    any_child = ('*',)
+    any_depth = ('..',)
     com_sep = set(['.', '#', '|', ':'])
+    re_document_start = re.compile(r'^---(?=[ \t\r\n]|$)[^\n]*\n?', re.M)
+    re_blank_or_comment = re.compile(r'^(?:[ \t]*(?:#.*|%.*)?\r?\n?)*$')
+    # a line starting a top level node that is not a list item
+    re_top_level_line = re.compile(br'^(?![ \t#\r\n]|-(?:[ \t\r\n]|$)).', re.M)
+    re_list_item_line = re.compile(br'^([ \t]*)-(?:[ \t\r\n]|$)')
+    re_quoted_scalar = {'"': re.compile(r'"(?:[^"\\\r\n]|\\.)*"'),
+                        "'": re.compile(r"'(?:[^'\r\n]|'')*'")}
+    chunk_size = 64 * 1024
+    durability_modes = ['full', 'data', 'batch', 'none']
+    conflict_retries = 3
+    conflict_backoff = 0.05
+    _pending_syncs = []
+    # filename -> (signature, indent, newline) of the files this process
+    # appended to, so appending again needs no scan while they are unchanged
+    _append_marks = {}
+    re_document_marker = re.compile(br'^(?:---|\.\.\.)(?:[ \t\r\n]|$)', re.M)
+    key_cache_size = 1024
+    _compiled_key_patterns = {}
+    _key_cache = collections.OrderedDict()
+    _selector_cache = {}
+    _text_digests = {}
 
     # pylint: disable=too-many-arguments
     def __init__(self,
@@ -221,7 +493,13 @@ class Yedit(object):
                  content_type='yaml',
                  separator='.',
                  backup_ext=".{0}".format(time.strftime("%Y%m%dT%H%M%S")),
-                 backup=False):
+                 backup=False,
+                 durability='full',
+                 preserve_format=True,
+                 document=None,
+                 cache_dir=None,
+                 cache_size=None,
+                 detect_conflicts=False):
         self.content = content
         self._separator = separator
         self.filename = filename
@@ -229,6 +507,31 @@ class Yedit(object):
         self.content_type = content_type
         self.backup = backup
         self.backup_ext = backup_ext
+        self.durability = durability
+        self.preserve_format = preserve_format
+        self.engine = None
+        self._json_style = None
+        self.document = document
+        self._document_text = None
+        self.detect_conflicts = detect_conflicts
+        self.base_signature = None
+        # the sha1 of the bytes last read from or written to the file
+        self.last_checksum = None
+        self.cache = None
+        if cache_dir:
+            self.cache = YeditCache(cache_dir, cache_size or YeditCache.default_max_size)
+        self._undo = None
+        self._undo_root = None
+        self._undo_patches = None
+        self._loaded = None
+        self._source = None
+        self._patches = None
+        self._hashes = {}
+        self._hash_parents = {}
+        self._changes = collections.OrderedDict()
+        self._originals = {}
+        self._item_indexes = {}
+        self._member_indexes = {}
         self.load(content_type=self.content_type)
         if self.__yaml_dict is None:
             self.__yaml_dict = {}
@@ -251,28 +554,229 @@ class Yedit(object):
     @yaml_dict.setter
     def yaml_dict(self, value):
         ''' setter method for yaml_dict '''
+        self._loaded = None
+        self._patches = None
+        self._hashes = {}
+        self._hash_parents = {}
+        self._item_indexes = {}
+        self._member_indexes = {}
         self.__yaml_dict = value
 
+    @staticmethod
+    def _key_patterns(sep):
+        '''return the compiled (validator, tokenizer) regexes for a separator'''
+        patterns = Yedit._compiled_key_patterns.get(sep)
+        if patterns is None:
+            common_separators = ''.join(Yedit.com_sep - set([sep]))
+            patterns = (re.compile(Yedit.re_valid_key.format(common_separators)),
+                        re.compile(Yedit.re_key.format(common_separators)))
+            Yedit._compiled_key_patterns[sep] = patterns
+
+        return patterns
+
     @staticmethod
     def parse_key(key, sep='.'):
         '''parse the key allowing the appropriate separator'''
-        common_separators = list(Yedit.com_sep - set([sep]))
-        return re.findall(Yedit.re_key.format(''.join(common_separators)), key)
+        return Yedit._key_patterns(sep)[1].findall(key)
 
     @staticmethod
     def valid_key(key, sep='.'):
         '''validate the incoming key'''
-        common_separators = list(Yedit.com_sep - set([sep]))
-        if not re.match(Yedit.re_valid_key.format(''.join(common_separators)), key):
+        if not Yedit._key_patterns(sep)[0].match(key):
             return False
 
         return True
 
+    @staticmethod
+    def compile_key(key, sep='.'):
+        '''compile the key into a tuple of path segments.
+           List indexes are ints, dict keys are strings and [field=value]
+           selectors of list items are (field, value) tuples.  The * and [*]
+           wildcards compile to any_child and a doubled separator, as in
+           a..image, to any_depth.
+           Returns None when the key is not valid.  Already compiled keys
+           are returned as they are.
+           Compiled keys are kept in a bounded LRU cache.
+        '''
+        if isinstance(key, tuple):
+            return key
+
+        cache_key = (key, sep)
+        try:
+            path = Yedit._key_cache.pop(cache_key)
+        except KeyError:
+            path = ()
+            for ind, part in enumerate(key.split(sep * 2)):
+                if ind:
+                    path += (Yedit.any_depth,)
+                elif part == '':
+                    continue
+                if not Yedit.valid_key(part, sep):
+                    path = None
+                    break
+                path += tuple(Yedit.any_child if '*' in (arr_ind, dict_key) else
+                              int(arr_ind) if arr_ind else (field, value) if field else dict_key
+                              for arr_ind, field, value, dict_key in Yedit.parse_key(part, sep))
+
+            if len(Yedit._key_cache) >= Yedit.key_cache_size:
+                Yedit._key_cache.popitem(last=False)
+
+        Yedit._key_cache[cache_key] = path
+        return path
+
+    # pylint: disable=too-many-return-statements,too-many-branches
+    @staticmethod
+    def format_key(path, sep='.'):
+        '''return the key of a compiled path'''
+        key = ''
+        for seg in path:
+            if seg == Yedit.any_depth:
+                key += sep * 2
+            elif seg == Yedit.any_child:
+                key += '[*]'
+            elif isinstance(seg, int):
+                key += '[{0}]'.format(seg)
+            elif isinstance(seg, tuple):
+                key += '[{0}={1}]'.format(*seg)
+            else:
+                key += (sep if key and not key.endswith(sep * 2) else '') + seg
+
+        return key
+
+    @staticmethod
+    def is_pattern(path):
+        '''return whether a compiled key has wildcards and so can match
+           more than one location
+        '''
+        return bool(path) and (Yedit.any_child in path or Yedit.any_depth in path)
+
+    # pylint: disable=too-many-locals
+    @staticmethod
+    def match_path(data, path, create=False, select=None):
+        '''return (parent, key, path) for every location a compiled key
+           with wildcards matches in data, in document order.  parent[key]
+           holds the match and path is its concrete compiled key.  Each
+           container is visited at most once per segment of the key.
+           With create, mapping keys named by the last segment that do not
+           exist yet are matched too, unless it follows any_depth.
+        '''
+        select = select or Yedit.select_item
+        matches = []
+        visited = set()
+        stack = [(data, None, None, (), 0)]
+        while stack:
+            node, parent, key, concrete, depth = stack.pop()
+            if depth == len(path):
+                matches.append((parent, key, concrete))
+                continue
+            if not isinstance(node, (dict, list)) or (id(node), depth) in visited:
+                continue
+            visited.add((id(node), depth))
+
+            seg = path[depth]
+            children = node.items() if isinstance(node, dict) else enumerate(node)
+            if seg == Yedit.any_depth:
+                # pushed in reverse so the node comes before its descendants
+                stack.extend((child, node, name, concrete + (name,), depth)
+                             for name, child in reversed(list(children)) if isinstance(child, (dict, list)))
+                stack.append((node, parent, key, concrete, depth + 1))
+                continue
+
+            if seg == Yedit.any_child:
+                stack.extend((child, node, name, concrete + (name,), depth + 1)
+                             for name, child in reversed(list(children)))
+                continue
+
+            if isinstance(seg, tuple):
+                seg = select(node, *seg) if isinstance(node, list) else None
+            elif isinstance(seg, int) and isinstance(node, list) and seg < 0:
+                seg += len(node)
+
+            if isinstance(seg, int) and isinstance(node, list) and 0 <= seg < len(node) or \
+               not isinstance(seg, int) and isinstance(node, dict) and seg in node:
+                stack.append((node[seg], node, seg, concrete + (seg,), depth + 1))
+            elif create and isinstance(node, dict) and isinstance(seg, str) and depth == len(path) - 1 and \
+                    (not depth or path[depth - 1] != Yedit.any_depth):
+                matches.append((node, seg, concrete + (seg,)))
+
+        return matches
+
+    @staticmethod
+    def selector_text(value):
+        '''return the text a field value is selected by: the yaml form of
+           booleans and null, the shortest form of numbers
+        '''
+        if value is None:
+            return 'null'
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, float):
+            return str(int(value)) if value.is_integer() else repr(float(value))
+        if isinstance(value, int):
+            return str(int(value))
+        return str(value)
+
+    @staticmethod
+    def selector_texts(value):
+        '''return the field texts a selector value matches: its own text and
+           the text of the yaml scalar it reads as
+        '''
+        texts = Yedit._selector_cache.get(value)
+        if texts is None:
+            texts = (value,)
+            try:
+                typed = yaml.load(value, Loader=FAST_LOADER)
+            except yaml.YAMLError:
+                typed = value
+            if not isinstance(typed, (dict, list)) and Yedit.selector_text(typed) != value:
+                texts += (Yedit.selector_text(typed),)
+
+            if len(Yedit._selector_cache) >= Yedit.key_cache_size:
+                Yedit._selector_cache.clear()
+            Yedit._selector_cache[value] = texts
+
+        return texts
+
+    @staticmethod
+    def select_item(items, field, value):
+        '''return the position of the first mapping in items whose field
+           reads as value, or None
+        '''
+        texts = Yedit.selector_texts(value)
+        for ind, item in enumerate(items):
+            if isinstance(item, dict) and field in item and Yedit.selector_text(item[field]) in texts:
+                return ind
+
+        return None
+
+    @staticmethod
+    def resolve_path(data, path):
+        '''return path with its selectors replaced by the positions of the
+           items they select in data, or None when one selects nothing
+        '''
+        if not [seg for seg in path if isinstance(seg, tuple)]:
+            return path
+
+        resolved = []
+        for seg in path:
+            if isinstance(seg, tuple):
+                seg = Yedit.select_item(data, *seg) if isinstance(data, list) and len(seg) == 2 else None
+                if seg is None:
+                    return None
+            resolved.append(seg)
+            data = Yedit.walk_path(data, (seg,))
+
+        return tuple(resolved)
+
     # pylint: disable=too-many-return-statements,too-many-branches
     @staticmethod
     def remove_entry(data, key, index=None, value=None, sep='.'):
         ''' remove data at location key '''
-        if key == '' and isinstance(data, dict):
+        path = Yedit.compile_key(key, sep)
+        if path is not None:
+            path = Yedit.resolve_path(data, path)
+
+        if path == () and isinstance(data, dict):
             if value is not None:
                 data.pop(value)
             elif index is not None:
@@ -282,7 +786,7 @@ class Yedit(object):
 
             return True
 
-        elif key == '' and isinstance(data, list):
+        elif path == () and isinstance(data, list):
             ind = None
             if value is not None:
                 try:
@@ -299,32 +803,31 @@ class Yedit(object):
 
             return True
 
-        if not (key and Yedit.valid_key(key, sep)) and \
-           isinstance(data, (list, dict)):
+        if not path:
             return None
 
-        key_indexes = Yedit.parse_key(key, sep)
-        for arr_ind, dict_key in key_indexes[:-1]:
-            if dict_key and isinstance(data, dict):
-                data = data.get(dict_key)
-            elif (arr_ind and isinstance(data, list) and
-                  int(arr_ind) <= len(data) - 1):
-                data = data[int(arr_ind)]
+        for seg in path[:-1]:
+            if isinstance(seg, int):
+                if isinstance(data, list) and seg <= len(data) - 1:
+                    data = data[seg]
+                else:
+                    return None
+            elif isinstance(data, dict):
+                data = data.get(seg)
             else:
                 return None
 
         # process last index for remove
         # expected list entry
-        if key_indexes[-1][0]:
-            if isinstance(data, list) and int(key_indexes[-1][0]) <= len(data) - 1:  # noqa: E501
-                del data[int(key_indexes[-1][0])]
+        if isinstance(path[-1], int):
+            if isinstance(data, list) and path[-1] <= len(data) - 1:
+                del data[path[-1]]
                 return True
 
         # expected dict entry
-        elif key_indexes[-1][1]:
-            if isinstance(data, dict):
-                del data[key_indexes[-1][1]]
-                return True
+        elif isinstance(data, dict):
+            del data[path[-1]]
+            return True
 
     @staticmethod
     def add_entry(data, key, item=None, sep='.'):
@@ -333,47 +836,48 @@ class Yedit(object):
             key = a#b
             return c
         '''
-        if key == '':
-            pass
-        elif (not (key and Yedit.valid_key(key, sep)) and
-              isinstance(data, (list, dict))):
+        path = Yedit.compile_key(key, sep)
+        if path is None:
             return None
 
-        key_indexes = Yedit.parse_key(key, sep)
-        for arr_ind, dict_key in key_indexes[:-1]:
-            if dict_key:
-                if isinstance(data, dict) and dict_key in data and data[dict_key]:  # noqa: E501
-                    data = data[dict_key]
+        resolved = Yedit.resolve_path(data, path)
+        if resolved is None:
+            raise YeditException("No list item matches the selectors of key path: {0}".format(key))
+        path = resolved
+
+        for seg in path[:-1]:
+            if not isinstance(seg, int):
+                if isinstance(data, dict) and seg in data and data[seg]:
+                    data = data[seg]
                     continue
 
                 elif data and not isinstance(data, dict):
                     raise YeditException("Unexpected item type found while going through key " +
-                                         "path: {0} (at key: {1})".format(key, dict_key))
+                                         "path: {0} (at key: {1})".format(key, seg))
 
-                data[dict_key] = {}
-                data = data[dict_key]
+                data[seg] = {}
+                data = data[seg]
 
-            elif (arr_ind and isinstance(data, list) and
-                  int(arr_ind) <= len(data) - 1):
-                data = data[int(arr_ind)]
+            elif isinstance(data, list) and seg <= len(data) - 1:
+                data = data[seg]
             else:
                 raise YeditException("Unexpected item type found while going through key path: {0}".format(key))
 
-        if key == '':
+        if not path:
             data = item
 
         # process last index for add
         # expected list entry
-        elif key_indexes[-1][0] and isinstance(data, list) and int(key_indexes[-1][0]) <= len(data):  # noqa: E501
+        elif isinstance(path[-1], int) and isinstance(data, list) and path[-1] <= len(data):
             # key is next element in array so append
-            if int(key_indexes[-1][0]) > len(data)-1:
+            if path[-1] > len(data)-1:
                 data.append(item)
             else:
-                data[int(key_indexes[-1][0])] = item
+                data[path[-1]] = item
 
         # expected dict entry
-        elif key_indexes[-1][1] and isinstance(data, dict):
-            data[key_indexes[-1][1]] = item
+        elif not isinstance(path[-1], int) and isinstance(data, dict):
+            data[path[-1]] = item
 
         # didn't add/update to an existing list, nor add/update key to a dict
         # so we must have been provided some syntax like a.b.c[<int>] = "data" for a
@@ -390,61 +894,318 @@ class Yedit(object):
             key = a.b
             return c
         '''
-        if key == '':
-            pass
-        elif (not (key and Yedit.valid_key(key, sep)) and
-              isinstance(data, (list, dict))):
+        path = Yedit.compile_key(key, sep)
+        if path is None:
             return None
 
-        key_indexes = Yedit.parse_key(key, sep)
-        for arr_ind, dict_key in key_indexes:
-            if dict_key and isinstance(data, dict):
-                data = data.get(dict_key)
-            elif (arr_ind and isinstance(data, list) and
-                  int(arr_ind) <= len(data) - 1):
-                data = data[int(arr_ind)]
+        return Yedit.walk_path(data, path)
+
+    @staticmethod
+    def walk_path(data, path):
+        ''' return the item at a compiled key path or None '''
+        for seg in path:
+            if isinstance(seg, tuple):
+                seg = Yedit.select_item(data, *seg) if isinstance(data, list) and len(seg) == 2 else None
+                if seg is None:
+                    return None
+                data = data[seg]
+            elif isinstance(seg, int):
+                if isinstance(data, list) and seg <= len(data) - 1:
+                    data = data[seg]
+                else:
+                    return None
+            elif isinstance(data, dict):
+                data = data.get(seg)
             else:
                 return None
 
         return data
 
     @staticmethod
-    def _write(filename, contents):
-        ''' Actually write the file contents to disk. This helps with mocking. '''
+    def file_checksum(filename, algorithm='sha256'):
+        ''' return the hex digest of the file, read in chunks '''
+        digest = hashlib.new(algorithm)
+        with open(filename, 'rb') as yfd:
+            while True:
+                chunk = yfd.read(Yedit.chunk_size)
+                if not chunk:
+                    return digest.hexdigest()
+                digest.update(chunk)
 
-        tmp_filename = filename + '.yedit'
-
-        with open(tmp_filename, 'w') as yfd:
-            fcntl.flock(yfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            yfd.write(contents)
-            yfd.flush()  # flush internal buffers
-            try:
-                os.fsync(yfd.fileno())  # ensure buffer content reached disk
-            except:
-                pass
-            fcntl.flock(yfd, fcntl.LOCK_UN)
+    @staticmethod
+    def checksum(filename):
+        ''' return the sha1 of a file, as ansible's stat reports it, or None '''
+        try:
+            return Yedit.file_checksum(filename, 'sha1')
+        except (IOError, OSError, TypeError):
+            return None
 
-        os.rename(tmp_filename, filename)
-        # While the rename is atomic, we also need to ensure, that the updated
-        # directory entry has reached the disk too.
+    @staticmethod
+    def _fsync(path, flags=os.O_RDONLY):
+        ''' fsync a file or, with os.O_DIRECTORY, a directory entry '''
         # NOTE: this might fail on Windows systems.
-        dfd = None
+        fd = None
         try:
-            dfd = os.open(os.path.join(os.path.realpath('.'), os.path.dirname(filename)), os.O_DIRECTORY)
-            os.fsync(dfd)
+            fd = os.open(path, flags)
+            os.fsync(fd)
         except:
             pass
         finally:
-            if dfd:
-                os.close(dfd)
+            if fd is not None:
+                os.close(fd)
+
+    @staticmethod
+    def sync_pending():
+        ''' fsync the files written in batch durability mode, then each of
+            their directories once
+        '''
+        filenames, Yedit._pending_syncs = Yedit._pending_syncs, []
+        for filename in filenames:
+            Yedit._fsync(filename)
+
+        for directory in sorted(set(os.path.dirname(filename) for filename in filenames)):
+            Yedit._fsync(directory, os.O_DIRECTORY)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _write(filename, contents, backup_filename=None, durability='full', expected_signature=None, digest=None):
+        ''' Actually write the file contents to disk. This helps with mocking.
+            contents is a string or a callable that serializes into the stream
+            it is passed, so large documents never exist as one string.
+            When the result is byte-identical to the file nothing is replaced
+            and no temp file is written.
+            With expected_signature, YeditConflict is raised instead of
+            replacing a file whose signature differs from it, () standing for
+            a file that does not exist.
+            digest, a hashlib object, is updated with the bytes written.
+            Returns whether the file changed.
+        '''
+        if durability not in Yedit.durability_modes:
+            raise YeditException('Unsupported durability: {0}. '.format(durability) +
+                                 'Please specify one of {0}.'.format(', '.join(Yedit.durability_modes)))
+
+        # one temp file per process, concurrent writers must not share it
+        tmp_filename = '{0}.yedit.{1}'.format(filename, os.getpid())
+
+        stream = YeditTempFile(filename, tmp_filename, digest)
+        try:
+            if callable(contents):
+                contents(stream)
+            else:
+                stream.write(contents)
+            if not stream.close(durability in ['full', 'data']):
+                return False
+        except Exception:
+            stream.discard()
+            raise
+
+        # Writers take turns on the file they replace between the conflict
+        # check and the rename, and wait for appenders holding it.
+        target_lock = YeditLock(filename, YeditLock.default_timeout, filename) if os.path.exists(filename) else None
+        try:
+            if target_lock:
+                try:
+                    target_lock.acquire()
+                except (IOError, OSError):
+                    target_lock = None
+
+            if expected_signature is not None and (Yedit.file_signature(filename) or ()) != expected_signature:
+                raise YeditConflict('{0} changed since it was loaded.'.format(filename))
+
+            if backup_filename and os.path.exists(filename):
+                shutil.copy(filename, backup_filename)
+
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+        finally:
+            if target_lock:
+                target_lock.release()
+        # While the rename is atomic, we also need to ensure, that the updated
+        # directory entry has reached the disk too.
+        if durability == 'full':
+            Yedit._fsync(os.path.dirname(os.path.abspath(filename)), os.O_DIRECTORY)
+        elif durability == 'batch':
+            Yedit._pending_syncs.append(os.path.abspath(filename))
+
+        return True
+
+    def _dump(self, stream):
+        ''' serialize the document into stream.
+            With a selected document of a multi-document file, the other
+            documents are written back as they were read.
+        '''
+        if self._document_text is None:
+            self._dump_document(stream)
+            return
+
+        prefix, header, suffix = self._document_text
+        stream.write(prefix)
+        stream.write(header)
+        if header and not header.endswith('\n'):
+            stream.write('\n')
+        self._dump_document(stream)
+        stream.write(suffix)
+
+    def _dump_document(self, stream):
+        ''' serialize the yaml_dict into stream '''
+        if self.content_type == 'yaml' and self._json_style:
+            # the yaml file was json, write it back in its own json style
+            try:
+                text = json.dumps(self.yaml_dict,
+                                  indent=self._json_style['indent'],
+                                  separators=self._json_style['separators'],
+                                  ensure_ascii=self._json_style['ensure_ascii'])
+            except (TypeError, ValueError):
+                # values json cannot hold, like dates, turn the file into yaml
+                self._json_style = None
+            else:
+                self.engine = 'json'
+                stream.write(text)
+                if self._json_style['newline']:
+                    stream.write('\n')
+                return
+
+        # Try to use RoundTripDumper if supported.
+        if self.content_type == 'yaml':
+            text = self._patched_source()
+            if text is not None:
+                # only scalars changed, the original text is kept around them
+                self.engine = 'patch'
+                stream.write(text)
+            elif not self.preserve_format:
+                self.engine = FAST_ENGINE
+                yaml.dump(self.yaml_dict, stream, Dumper=FAST_DUMPER, default_flow_style=False)
+            elif hasattr(yaml, 'RoundTripDumper'):
+                self.engine = 'round_trip'
+                yaml.dump(self.yaml_dict, stream, Dumper=yaml.RoundTripDumper)
+            else:
+                self.engine = 'safe'
+                yaml.safe_dump(self.yaml_dict, stream, default_flow_style=False)
+        else:
+            self.engine = 'json'
+            json.dump(self.yaml_dict, stream, indent=4, sort_keys=True)
+
+    @staticmethod
+    def _scalar_span(text, start):
+        ''' return the end of the single line scalar starting at start in
+            text or None when it is not one
+        '''
+        line_end = text.find('\n', start)
+        if line_end < 0:
+            line_end = len(text)
+        line = text[start:line_end].rstrip('\r')
+        if not line or line[0] in '|>&*!%@`{[,]}# \t':
+            return None
+
+        if line[0] in Yedit.re_quoted_scalar:
+            match = Yedit.re_quoted_scalar[line[0]].match(line)
+            return start + match.end() if match else None
+
+        # a plain scalar ends at a comment, or at a flow indicator inside
+        # a flow collection; the caller checks which one parses back
+        comment = re.search(r'\s#', line)
+        if comment:
+            line = line[:comment.start()]
+        return start + len(line.rstrip())
+
+    @staticmethod
+    def _render_scalar(value, quote=None):
+        ''' return value as a single line yaml scalar in the quote style of
+            the value it replaces or None
+        '''
+        if quote and isinstance(value, str) and not re.search(r'[\x00-\x1f\x7f\u2028\u2029]', value):
+            if quote == "'":
+                return "'{0}'".format(value.replace("'", "''"))
+            return json.dumps(value, ensure_ascii=False)
+
+        text = yaml.dump([value], Dumper=yaml.RoundTripDumper, default_flow_style=True,
+                         allow_unicode=True, width=float('inf')).rstrip('\n')
+        if '\n' in text or not (text.startswith('[') and text.endswith(']')):
+            return None
+        return text[1:-1]
+
+    def _patched_source(self):
+        ''' return the loaded text with the changed scalars replaced in
+            place, using the positions ruamel recorded when loading it.
+            Returns None when the document has to be dumped: structural
+            changes, values not on a single line or anything that does not
+            parse back to the expected value.
+        '''
+        if self._source is None or self._patches is None or \
+           getattr(self.yaml_dict, 'fa', None) is None:
+            return None
+
+        try:
+            spans = []
+            for path, old_value in self._patches.items():
+                parent = Yedit.walk_path(self.yaml_dict, path[:-1])
+                if isinstance(parent, dict):
+                    line, column = parent.lc.value(path[-1])
+                else:
+                    line, column = parent.lc.item(path[-1])
+                spans.append((line, column, old_value, parent[path[-1]]))
+        except (AttributeError, KeyError, IndexError, TypeError):
+            return None
+
+        spans.sort(key=lambda span: span[:2])
+        text = self._source
+        offset, offset_line = 0, 0
+        edits = []
+        for line, column, old_value, value in spans:
+            while offset_line < line:
+                offset = text.find('\n', offset) + 1
+                if offset == 0:
+                    return None
+                offset_line += 1
+            start = offset + column
+            end = Yedit._scalar_span(text, start)
+            if end is None:
+                return None
+
+            # a plain scalar inside a flow collection ends at the indicator
+            old_text = text[start:end]
+            for candidate in [old_text, re.split(r'\s*[,\]}]', old_text)[0]]:
+                if not candidate:
+                    continue
+                try:
+                    if Yedit.load_text(candidate) == old_value:
+                        break
+                except yaml.YAMLError:
+                    pass
+            else:
+                return None
+
+            new_text = Yedit._render_scalar(value, candidate[0] if candidate[0] in '\'"' else None)
+            try:
+                if new_text is None or Yedit.load_text(new_text) != value:
+                    return None
+            except yaml.YAMLError:
+                return None
+            edits.append((start, start + len(candidate), new_text))
+
+        parts = []
+        position = len(text)
+        for start, end, new_text in reversed(edits):
+            parts.append(text[end:position])
+            parts.append(new_text)
+            position = start
+        parts.append(text[:position])
+
+        return ''.join(reversed(parts))
 
     def write(self):
-        ''' write to file '''
+        ''' write to file.
+            Returns (False, yaml_dict) without replacing the file or making a
+            backup when the serialized document is byte-identical.
+        '''
         if not self.filename:
             raise YeditException('Please specify a filename.')
 
-        if self.backup and self.file_exists():
-            shutil.copy(self.filename, '{0}{1}'.format(self.filename, self.backup_ext))
+        if self.content_type not in ['yaml', 'json']:
+            raise YeditException('Unsupported content_type: {0}.'.format(self.content_type) +
+                                 'Please specify a content_type of yaml or json.')
 
         # Try to set format attributes if supported
         try:
@@ -452,19 +1213,20 @@ class Yedit(object):
         except AttributeError:
             pass
 
-        # Try to use RoundTripDumper if supported.
-        if self.content_type == 'yaml':
-            try:
-                Yedit._write(self.filename, yaml.dump(self.yaml_dict, Dumper=yaml.RoundTripDumper))
-            except AttributeError:
-                Yedit._write(self.filename, yaml.safe_dump(self.yaml_dict, default_flow_style=False))
-        elif self.content_type == 'json':
-            Yedit._write(self.filename, json.dumps(self.yaml_dict, indent=4, sort_keys=True))
-        else:
-            raise YeditException('Unsupported content_type: {0}.'.format(self.content_type) +
-                                 'Please specify a content_type of yaml or json.')
+        backup_filename = None
+        if self.backup:
+            backup_filename = '{0}{1}'.format(self.filename, self.backup_ext)
 
-        return (True, self.yaml_dict)
+        expected_signature = None
+        if self.detect_conflicts:
+            expected_signature = self.base_signature or ()
+
+        digest = hashlib.sha1()
+        changed = Yedit._write(self.filename, self._dump, backup_filename, self.durability, expected_signature,
+                               digest)
+        self.last_checksum = digest.hexdigest()
+
+        return (changed, self.yaml_dict)
 
     def read(self):
         ''' read from file '''
@@ -472,11 +1234,12 @@ class Yedit(object):
         if self.filename is None or not self.file_exists():
             return None
 
-        contents = None
-        with open(self.filename) as yfd:
-            contents = yfd.read()
+        with open(self.filename, 'rb') as yfd:
+            data = yfd.read()
+        self.last_checksum = hashlib.sha1(data).hexdigest()
 
-        return contents
+        # decoded as a file opened in text mode would be
+        return io.TextIOWrapper(io.BytesIO(data)).read()
 
     def file_exists(self):
         ''' return whether file exists '''
@@ -485,51 +1248,911 @@ class Yedit(object):
 
         return False
 
-    def load(self, content_type='yaml'):
-        ''' return yaml file '''
-        contents = self.read()
-
-        if not contents and not self.content:
+    @staticmethod
+    def file_signature(filename):
+        ''' return the (inode, size, mtime_ns) of a file or None '''
+        try:
+            stat = os.stat(filename)
+        except (OSError, TypeError):
             return None
 
-        if self.content:
-            if isinstance(self.content, dict):
-                self.yaml_dict = self.content
-                return self.yaml_dict
-            elif isinstance(self.content, str):
-                contents = self.content
+        return (stat.st_ino, stat.st_size, getattr(stat, 'st_mtime_ns', int(stat.st_mtime * 1e9)))
 
-        # check if it is yaml
-        try:
-            if content_type == 'yaml' and contents:
-                # Try to set format attributes if supported
-                try:
-                    self.yaml_dict.fa.set_block_style()
-                except AttributeError:
-                    pass
+    def stat_signature(self):
+        ''' return the (inode, size, mtime_ns) of the file or None '''
+        return Yedit.file_signature(self.filename)
 
-                # Try to use RoundTripLoader if supported.
-                try:
-                    self.yaml_dict = yaml.load(contents, yaml.RoundTripLoader)
-                except AttributeError:
-                    self.yaml_dict = yaml.safe_load(contents)
+    @staticmethod
+    def load_json_style(contents):
+        ''' parse yaml contents that are really json.
+            Returns (data, style) where style holds the json.dump arguments
+            reproducing the original formatting, or (None, None) when the
+            contents are not json or the detected style does not reproduce
+            them byte for byte.
+        '''
+        stripped = contents.lstrip()
+        if not stripped or stripped[0] not in '{[':
+            return (None, None)
 
-                # Try to set format attributes if supported
-                try:
-                    self.yaml_dict.fa.set_block_style()
-                except AttributeError:
-                    pass
+        try:
+            data = json.loads(contents)
+        except ValueError:
+            return (None, None)
+
+        indent = None
+        lines = stripped.rstrip().split('\n', 2)
+        if len(lines) > 1:
+            indent = lines[1][:len(lines[1]) - len(lines[1].lstrip())]
+            indent = len(indent) if indent.strip(' ') == '' else indent
+
+        key_separator = ': ' if '": ' in contents else ':'
+        if indent is not None:
+            separators = (',', key_separator)
+        else:
+            separators = (', ' if ', ' in contents else ',', key_separator)
+
+        try:
+            contents.encode('ascii')
+            ensure_ascii = True
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            ensure_ascii = False
+
+        style = {'indent': indent,
+                 'separators': separators,
+                 'ensure_ascii': ensure_ascii,
+                 'newline': contents.endswith('\n')}
+        # the style is a guess, only keep it when it round-trips the file
+        dumped = json.dumps(data, indent=indent, separators=separators, ensure_ascii=ensure_ascii)
+        if dumped + ('\n' if style['newline'] else '') != contents:
+            return (None, None)
+
+        return (data, style)
+
+    @staticmethod
+    def split_documents(contents):
+        ''' split a yaml stream into documents with a cheap text pass over the
+            --- markers.  Returns a list of (header, body) strings that
+            concatenate back to contents.  The header holds the marker line
+            and any comments or directives in front of the first marker.
+        '''
+        starts = [match.start() for match in Yedit.re_document_start.finditer(contents)]
+        if not starts:
+            return [('', contents)]
+
+        documents = []
+        leading = contents[:starts[0]]
+        if not Yedit.re_blank_or_comment.match(leading):
+            documents.append(('', leading))
+            leading = ''
+
+        for ind, start in enumerate(starts):
+            end = starts[ind + 1] if ind + 1 < len(starts) else len(contents)
+            marker = Yedit.re_document_start.match(contents, start)
+            rest_of_line = marker.group(0)[3:]
+            if rest_of_line.strip() and not rest_of_line.strip().startswith('#'):
+                # the document starts on the marker line: --- {a: 1}
+                header_end = start + 3
+            else:
+                header_end = marker.end()
+            documents.append((leading + contents[start:header_end], contents[header_end:end]))
+            leading = ''
+
+        return documents
+
+    @staticmethod
+    def select_document(documents, selector, sep='.'):
+        ''' return the index of the document matching selector, either an
+            index or comma separated key=value pairs.  Only documents
+            containing every value as text are parsed to check the keys.
+        '''
+        selector = str(selector).strip()
+        if re.match(r'^-?\d+$', selector):
+            ind = int(selector)
+            if -len(documents) <= ind < len(documents):
+                return ind % len(documents)
+            raise YeditException('Document index {0} out of range, the file has {1} documents.'.format(ind, len(documents)))
+
+        predicates = []
+        for pair in selector.split(','):
+            if '=' not in pair:
+                raise YeditException('Invalid document selector: {0}. Expected key=value pairs.'.format(selector))
+            key, value = pair.split('=', 1)
+            predicates.append((key.strip(), value.strip()))
+
+        for ind, (_, body) in enumerate(documents):
+            if not all(value in body for _, value in predicates):
+                continue
+
+            try:
+                data = yaml.load(body, Loader=FAST_LOADER)
+            except yaml.YAMLError:
+                continue
+
+            for key, value in predicates:
+                entry = Yedit.get_entry(data, key, sep)
+                if entry is None or str(entry) != value:
+                    break
+            else:
+                return ind
+
+        raise YeditException('No document matches the selector: {0}'.format(selector))
+
+    @staticmethod
+    def load_text(contents, preserve_format=True):
+        ''' parse yaml text with the engine load() would use '''
+        if not preserve_format:
+            return yaml.load(contents, Loader=FAST_LOADER)
+
+        try:
+            return yaml.load(contents, yaml.RoundTripLoader)
+        except AttributeError:
+            return yaml.safe_load(contents)
+
+    @staticmethod
+    def _skip_events(event, events, collected=None):
+        ''' consume the events of the node starting with event '''
+        depth = 0
+        while True:
+            if collected is not None:
+                collected.append(event)
+            if isinstance(event, yaml.events.CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, yaml.events.CollectionEndEvent):
+                depth -= 1
+            if depth == 0:
+                return collected
+            event = next(events)
+
+    # pylint: disable=too-many-return-statements,too-many-branches
+    @staticmethod
+    def stream_get(filename, key, sep='.', preserve_format=True):
+        ''' Look up key by walking the parser events of the file.  Siblings
+            of the path are skipped without being constructed, only the value
+            at key is built and reading stops as soon as it is complete.
+            Returns (True, value), or (False, None) when the lookup needs a
+            full load: aliases, merge keys, tags, selectors or negative
+            indexes on the path, or a file that cannot be read.
+        '''
+        path = Yedit.compile_key(key, sep)
+        try:
+            with open(filename) as yfd:
+                return Yedit.stream_lookup(yfd, path, preserve_format)
+        except (IOError, OSError):
+            return (False, None)
+
+    @staticmethod
+    def stream_lookup(stream, path, preserve_format=True):
+        ''' Look up the compiled key path in yaml text or a stream, as
+            stream_get() does for a file.
+        '''
+        if not path or [seg for seg in path if isinstance(seg, tuple) or isinstance(seg, int) and seg < 0]:
+            return (False, None)
+
+        try:
+            events = yaml.parse(stream, Loader=FAST_LOADER)
+            next(events)
+            event = next(events)
+            if not isinstance(event, yaml.events.DocumentStartEvent):
+                return (False, None)
+
+            node = next(events)
+            for seg in path:
+                if isinstance(node, yaml.events.AliasEvent) or \
+                   isinstance(node, yaml.events.CollectionStartEvent) and not node.implicit:
+                    return (False, None)
+
+                if isinstance(seg, int):
+                    if not isinstance(node, yaml.events.SequenceStartEvent):
+                        return (True, None)
+                    for ind in range(seg + 1):
+                        event = next(events)
+                        if isinstance(event, yaml.events.SequenceEndEvent):
+                            return (True, None)
+                        if ind < seg:
+                            Yedit._skip_events(event, events)
+                    node = event
+                    continue
+
+                if not isinstance(node, yaml.events.MappingStartEvent):
+                    return (True, None)
+                while True:
+                    event = next(events)
+                    if isinstance(event, yaml.events.MappingEndEvent):
+                        return (True, None)
+                    if isinstance(event, yaml.events.ScalarEvent) and event.value in [seg, '<<']:
+                        if event.value == '<<' or \
+                           not event.style and not isinstance(Yedit.load_text(event.value, preserve_format), str):
+                            # merge keys and keys that are not strings
+                            return (False, None)
+                        node = next(events)
+                        break
+                    Yedit._skip_events(event, events)
+                    Yedit._skip_events(next(events), events)
+
+            collected = Yedit._skip_events(node, events, [])
+        except (StopIteration, yaml.YAMLError):
+            return (False, None)
+
+        text = yaml.emit([yaml.events.StreamStartEvent(), yaml.events.DocumentStartEvent()] +
+                         collected +
+                         [yaml.events.DocumentEndEvent(), yaml.events.StreamEndEvent()])
+        try:
+            return (True, Yedit.load_text(text, preserve_format))
+        except yaml.YAMLError:
+            # an alias to an anchor outside of the value
+            return (False, None)
+
+    @staticmethod
+    def _last_top_level_line(yfd, size):
+        ''' return the offset of the last line of the binary file yfd that
+            starts a top level node other than a list item, or -1.  The file
+            is scanned backwards a chunk at a time.
+        '''
+        end = size
+        partial = b''
+        while end > 0:
+            start = max(0, end - Yedit.chunk_size)
+            yfd.seek(start)
+            chunk = yfd.read(end - start) + partial
+            offset = start
+            if start > 0:
+                # the first line may continue in the previous chunk
+                newline = chunk.find(b'\n')
+                if newline < 0:
+                    partial, end = chunk, start
+                    continue
+                partial, chunk = chunk[:newline + 1], chunk[newline + 1:]
+                offset += newline + 1
+
+            match = None
+            for match in Yedit.re_top_level_line.finditer(chunk):
+                pass
+            if match is not None:
+                return offset + match.start()
+            end = start
+
+        return -1
+
+    @staticmethod
+    def _has_document_marker(yfd, end):
+        ''' return whether a line of the first end bytes of the binary file
+            yfd starts or ends a document.  Read a chunk at a time.
+        '''
+        yfd.seek(0)
+        partial = b''
+        position = 0
+        while position < end:
+            chunk = partial + yfd.read(min(Yedit.chunk_size, end - position))
+            position += Yedit.chunk_size
+            # the last line may continue in the next chunk
+            newline = chunk.rfind(b'\n') if position < end else len(chunk) - 1
+            partial = chunk[newline + 1:]
+            if Yedit.re_document_marker.search(chunk[:newline + 1]):
+                return True
+
+        return bool(Yedit.re_document_marker.search(partial))
+
+    # pylint: disable=too-many-return-statements
+    @staticmethod
+    def _find_list_end(yfd, size, path):
+        ''' return the (indent, newline) of the items of the block list at
+            path, a top level key or the root, when it ends the single
+            document of the binary file yfd, or None
+        '''
+        start = Yedit._last_top_level_line(yfd, size)
+        yfd.seek(max(start, 0))
+        if path:
+            line = yfd.readline()
+            pattern = br'^' + re.escape(path[0].encode('utf-8')) + br':[ \t]*(?:#.*)?\r?\n$'
+            if start < 0 or not re.match(pattern, line) or Yedit._has_document_marker(yfd, start):
+                return None
+            yfd.seek(start + len(line))
+        elif start >= 0:
+            # a root list may only follow the document start marker
+            yfd.seek(0)
+            head = yfd.read(start)
+            line = yfd.readline()
+            if not re.match(br'^---[ \t]*(?:#.*)?\r?\n$', line) or \
+               not Yedit.re_blank_or_comment.match(head.decode('utf-8', 'replace')):
+                return None
+        else:
+            line = b'\n'
+
+        # the first item of the list gives its indentation
+        first = yfd.readline()
+        while first and Yedit.re_blank_or_comment.match(first.decode('utf-8', 'replace')):
+            first = yfd.readline()
+        match = Yedit.re_list_item_line.match(first)
+        if not match:
+            return None
+
+        return (match.group(1).decode('ascii'), '\r\n' if line.endswith(b'\r\n') else '\n')
+
+    # pylint: disable=too-many-return-statements,too-many-locals
+    @staticmethod
+    def append_in_place(filename, key, value, sep='.', durability='full'):
+        ''' Append value to the list at key without parsing the file, when
+            the list is the last block of the file: a block list under a top
+            level key, or a root list.  The tail of the file is scanned back
+            to the line that starts the list, and the rendered item is
+            written with O_APPEND holding the lock writers take on the file.
+            The file must hold a single document.
+            Returns False, without touching the file, when this cannot be
+            done safely and the document has to be loaded instead.
+        '''
+        path = Yedit.compile_key(key, sep)
+        if path is None or len(path) > 1 or path and not isinstance(path[0], str) or \
+           durability not in Yedit.durability_modes:
+            return False
+
+        dumper = getattr(yaml, 'RoundTripDumper', yaml.SafeDumper)
+        item = yaml.dump([value], Dumper=dumper, default_flow_style=False,
+                         allow_unicode=True, width=float('inf'))
+        try:
+            if Yedit.load_text(item) != [value]:
+                return False
+        except yaml.YAMLError:
+            return False
+
+        try:
+            fd = os.open(filename, os.O_RDWR | os.O_APPEND)
+        except (OSError, TypeError):
+            return False
+
+        with os.fdopen(fd, 'rb') as yfd:
+            lock = Yedit._lock_target(filename)
+            if lock is None:
+                return False
+            try:
+                stat = os.fstat(fd)
+                signature = Yedit.file_signature(filename)
+                if signature is None or signature[0] != stat.st_ino:
+                    # the file was replaced since it was opened
+                    return False
+                size = stat.st_size
+                mark = Yedit._append_marks.get(os.path.abspath(filename))
+                if mark is not None and mark[0] == (path, signature):
+                    indent, newline = mark[1:]
+                else:
+                    found = Yedit._find_list_end(yfd, size, path)
+                    if found is None:
+                        return False
+                    indent, newline = found
+
+                text = ''.join(indent + item_line + newline for item_line in item.splitlines())
+
+                yfd.seek(size - 1)
+                if yfd.read(1) != b'\n':
+                    text = newline + text
+
+                data = text.encode('utf-8')
+                while data:
+                    data = data[os.write(fd, data):]
+
+                if durability in ['full', 'data']:
+                    os.fsync(fd)
+                elif durability == 'batch':
+                    Yedit._pending_syncs.append(os.path.abspath(filename))
+                Yedit._append_marks[os.path.abspath(filename)] = ((path, Yedit.file_signature(filename)),
+                                                                  indent, newline)
+            finally:
+                lock.release()
+
+        return True
+
+    def load(self, content_type='yaml'):
+        ''' return yaml file '''
+        # Reuse the parsed document when the file did not change since it
+        # was loaded and the document was not modified in memory.
+        # The file is stat'ed before it is read so a change made while
+        # reading only causes an extra parse on the next load.
+        signature = None
+        if not self.content:
+            signature = self.stat_signature()
+            # the version of the file the edits are made on
+            self.base_signature = signature
+            if signature is not None and self._loaded == (signature, content_type):
+                return self.yaml_dict
+
+        contents = self.read()
+
+        if not contents and not self.content:
+            return None
+
+        if self.content:
+            if isinstance(self.content, dict):
+                self.yaml_dict = self.content
+                return self.yaml_dict
+            elif isinstance(self.content, str):
+                contents = self.content
+
+        self._document_text = None
+        if self.document is not None and content_type == 'yaml' and contents:
+            # only the selected document is parsed, the others are kept as text
+            documents = Yedit.split_documents(contents)
+            ind = Yedit.select_document(documents, self.document, self.separator)
+            header, contents = documents[ind]
+            self._document_text = (''.join(head + body for head, body in documents[:ind]),
+                                   header,
+                                   ''.join(head + body for head, body in documents[ind + 1:]))
+
+        self._json_style = None
+        self._source = None
+        self._changes = collections.OrderedDict()
+        self._originals = {}
+        if content_type == 'yaml' and contents:
+            # json is valid yaml, but the json parser is much faster
+            data, self._json_style = Yedit.load_json_style(contents)
+            if self._json_style:
+                self.engine = 'json'
+                self.yaml_dict = data
+
+        # check if it is yaml
+        try:
+            if content_type == 'yaml' and contents and self._json_style:
+                pass
+
+            elif content_type == 'yaml' and contents and not self.preserve_format:
+                self.engine = FAST_ENGINE
+                self.yaml_dict = self._parse(contents, 'json', lambda text: yaml.load(text, Loader=FAST_LOADER))
+
+            elif content_type == 'yaml' and contents:
+                # Try to set format attributes if supported
+                try:
+                    self.yaml_dict.fa.set_block_style()
+                except AttributeError:
+                    pass
+
+                # Try to use RoundTripLoader if supported.
+                try:
+                    self.engine = 'round_trip'
+                    self.yaml_dict = self._parse(contents, 'pickle',
+                                                 lambda text: yaml.load(text, yaml.RoundTripLoader))
+                    # kept to patch changed scalars into on write, unless the
+                    # root is flow style, which write() turns into block style
+                    if not self.yaml_dict.fa.flow_style():
+                        self._source = contents
+                        self._patches = {}
+                except AttributeError:
+                    self.engine = 'safe'
+                    self.yaml_dict = yaml.safe_load(contents)
+
+                # Try to set format attributes if supported
+                try:
+                    self.yaml_dict.fa.set_block_style()
+                except AttributeError:
+                    pass
 
             elif content_type == 'json' and contents:
+                self.engine = 'json'
                 self.yaml_dict = json.loads(contents)
         except yaml.YAMLError as err:
             # Error loading yaml or json
             raise YeditException('Problem with loading yaml file. {0}'.format(err))
 
+        if signature is not None:
+            self._loaded = (signature, content_type)
+
         return self.yaml_dict
 
+    def _parse(self, contents, fmt, parse):
+        ''' return parse(contents), from the parse cache when it has the tree.
+            fmt is the format the tree is cached in.
+        '''
+        if self.cache is None:
+            return parse(contents)
+
+        key = YeditCache.key(self.engine, contents)
+        found, data = self.cache.get(key, fmt)
+        if not found:
+            data = parse(contents)
+            self.cache.put(key, fmt, data)
+
+        return data
+
+    def begin(self):
+        ''' start a batch of edits that is kept or rolled back as a unit.
+            Returns False when a batch is already in progress.
+        '''
+        if self._undo is not None:
+            return False
+
+        self._undo = {}
+        self._undo_root = self.yaml_dict
+        self._undo_patches = None if self._patches is None else dict(self._patches)
+        return True
+
+    def commit(self):
+        ''' keep the edits of the current batch '''
+        self._undo = None
+        self._undo_root = None
+        self._undo_patches = None
+
+    def rollback(self):
+        ''' undo every edit made since begin() '''
+        if self._undo is None:
+            return
+
+        for node, saved in self._undo.values():
+            if isinstance(node, dict):
+                node.clear()
+                node.update(saved)
+            else:
+                # bypass CommentedSeq item bookkeeping, it does not handle slices
+                list.__delitem__(node, slice(None, None))
+                list.extend(node, saved)
+
+        self.yaml_dict = self._undo_root
+        self._patches = self._undo_patches
+        self._item_indexes = {}
+        self._member_indexes = {}
+        self.commit()
+
+    def _touch(self, path, scalar=False):
+        ''' called before the containers along path are modified.
+            Inside a batch, the first time a container is touched a shallow
+            copy of it is saved so rollback() can restore it in place.  Only
+            touched containers are copied, never the whole document.
+            scalar is True when only the scalar at path is replaced, which
+            write() can patch into the loaded text.
+        '''
+        # the in-memory document no longer matches the file
+        self._loaded = None
+
+        compiled = Yedit.compile_key(path, self.separator)
+        if compiled is not None and compiled not in self._changes:
+            # the node the path held before it was first changed, its
+            # content is kept in _originals as its containers are modified
+            self._changes[compiled] = (path if not isinstance(path, tuple) else
+                                       Yedit.format_key(path, self.separator),
+                                       Yedit.walk_path(self.yaml_dict, compiled))
+
+        if self._patches is not None:
+            if scalar and compiled and not [seg for seg in compiled if isinstance(seg, int) and seg < 0]:
+                # remember the value the loaded text holds at path
+                self._patches.setdefault(compiled, Yedit.walk_path(self.yaml_dict, compiled))
+            else:
+                self._patches = None
+
+        node = self.yaml_dict
+        for depth, seg in enumerate((None,) + (compiled or ())):
+            if seg is None:
+                pass
+            elif isinstance(seg, int):
+                if not (isinstance(node, list) and seg <= len(node) - 1):
+                    break
+                node = node[seg]
+            elif isinstance(node, dict):
+                node = node.get(seg)
+            else:
+                break
+
+            if not isinstance(node, (dict, list)):
+                break
+
+            self._forget_hash(node)
+            if isinstance(node, list) and id(node) in self._item_indexes:
+                remaining = len(compiled) - depth
+                if remaining <= 1:
+                    # the list or a whole item is modified
+                    self._item_indexes.pop(id(node))
+                elif remaining == 2:
+                    # a field of an item is modified
+                    self._item_indexes[id(node)][1].pop(compiled[-1], None)
+            saved = None
+            if id(node) not in self._originals:
+                saved = list(node.items()) if isinstance(node, dict) else list(node)
+                self._originals[id(node)] = (node, saved)
+            if self._undo is not None and id(node) not in self._undo:
+                if saved is None:
+                    saved = list(node.items()) if isinstance(node, dict) else list(node)
+                self._undo[id(node)] = (node, saved)
+
+    @staticmethod
+    def _scalar_token(value):
+        ''' return the text hashed for a scalar.  Numbers and timestamps that
+            compare equal get the same text whatever their type.
+        '''
+        if isinstance(value, (bool, int)):
+            return 'n:{0}'.format(int(value))
+        if isinstance(value, float):
+            if value.is_integer():
+                return 'n:{0}'.format(int(value))
+            return 'n:{0!r}'.format(float(value))
+        if isinstance(value, str):
+            return 's:' + value
+        if value is None:
+            return 'z:'
+        if isinstance(value, datetime.datetime):
+            offset = value.utcoffset()
+            if offset is None:
+                return 't:' + datetime.datetime.isoformat(value)
+            return 't:{0}Z'.format(datetime.datetime.isoformat(value.replace(tzinfo=None) - offset))
+        if isinstance(value, datetime.date):
+            return 'd:' + datetime.date.isoformat(value)
+        return '{0}:{1!r}'.format(type(value).__name__, value)
+
+    @staticmethod
+    def value_hash(value, cache=None, parents=None):
+        ''' return a digest of value that is the same for values that compare
+            equal: mappings whatever their key order, numbers whatever their
+            type.  With cache, container digests are kept in it by id and
+            parents records the containers each container is in.
+        '''
+        if type(value) is str:
+            # mostly mapping keys, the same few over and over
+            digest = Yedit._text_digests.get(value)
+            if digest is None:
+                digest = hashlib.sha1(('s:' + value).encode('utf-8')).digest()
+                if len(Yedit._text_digests) >= Yedit.key_cache_size:
+                    Yedit._text_digests.clear()
+                Yedit._text_digests[value] = digest
+            return digest
+        if not isinstance(value, (dict, list)):
+            return hashlib.sha1(Yedit._scalar_token(value).encode('utf-8')).digest()
+
+        if cache is not None and id(value) in cache:
+            return cache[id(value)][1]
+
+        if isinstance(value, dict):
+            children = value.values()
+            digest = hashlib.sha1(b'{' + b''.join(sorted(Yedit.value_hash(key, cache, parents) +
+                                                         Yedit.value_hash(item, cache, parents)
+                                                         for key, item in value.items()))).digest()
+        else:
+            children = value
+            digest = hashlib.sha1(b'[' + b''.join(Yedit.value_hash(item, cache, parents)
+                                                  for item in value)).digest()
+
+        if cache is not None:
+            # the container is kept referenced so its id is not reused
+            cache[id(value)] = (value, digest)
+            for child in children:
+                if isinstance(child, (dict, list)):
+                    parents.setdefault(id(child), set()).add(id(value))
+
+        return digest
+
+    def tree_hash(self, node):
+        ''' return the digest of a node of the document.  Container digests
+            are cached until _touch() invalidates them.
+        '''
+        return Yedit.value_hash(node, self._hashes, self._hash_parents)
+
+    def _forget_hash(self, node):
+        ''' drop the cached digests of node and of every container above it,
+            including the ones it is shared with through aliases
+        '''
+        stack = [id(node)]
+        while stack:
+            node_id = stack.pop()
+            self._hashes.pop(node_id, None)
+            self._member_indexes.pop(node_id, None)
+            stack.extend(self._hash_parents.pop(node_id, ()))
+
+    def equals(self, node, value):
+        ''' compare a node of the document to value.  Containers compare
+            through their digests: the cached digest of the node against
+            the digest of value, which is hashed once.
+        '''
+        if isinstance(node, (dict, list)) and isinstance(value, (dict, list)):
+            if isinstance(node, dict) != isinstance(value, dict) or len(node) != len(value):
+                return False
+            return self.tree_hash(node) == Yedit.value_hash(value)
+
+        return node == value
+
+    def _original_hash(self, node, stale, digests):
+        ''' return the digest of node as it was loaded, hashed as
+            value_hash() hashes it from the contents _touch() saved before
+            its containers were first modified.  Cached digests are reused
+            for the containers no edit reached, the ones not in stale.
+        '''
+        if not isinstance(node, (dict, list)):
+            return Yedit.value_hash(node)
+        if id(node) in self._hashes and id(node) not in stale:
+            return self._hashes[id(node)][1]
+        if id(node) in digests:
+            return digests[id(node)]
+
+        if id(node) in self._originals:
+            saved = self._originals[id(node)][1]
+        else:
+            saved = list(node.items()) if isinstance(node, dict) else node
+        if isinstance(node, dict):
+            digest = hashlib.sha1(b'{' + b''.join(sorted(Yedit.value_hash(key) +
+                                                         self._original_hash(item, stale, digests)
+                                                         for key, item in saved))).digest()
+        else:
+            digest = hashlib.sha1(b'[' + b''.join(self._original_hash(item, stale, digests)
+                                                  for item in saved)).digest()
+        digests[id(node)] = digest
+        return digest
+
+    def changed_paths(self):
+        ''' return the edited paths whose digest differs from the digest of
+            the value they held before their first edit.  Paths inside a
+            reported path are left out.
+        '''
+        changes = sorted(self._changes.items(), key=lambda item: len(item[0]))
+        current = dict((compiled, self.tree_hash(Yedit.walk_path(self.yaml_dict, compiled)))
+                       for compiled, _ in changes)
+
+        # the modified containers and every container they are in: their
+        # cached digests are the ones of the edited document
+        stale = set()
+        stack = list(self._originals)
+        while stack:
+            node_id = stack.pop()
+            if node_id not in stale:
+                stale.add(node_id)
+                stack.extend(self._hash_parents.get(node_id, ()))
+
+        reported = []
+        digests = {}
+        for compiled, (_, old) in changes:
+            if [prefix for prefix in reported if compiled[:len(prefix)] == prefix]:
+                continue
+            if current[compiled] != self._original_hash(old, stale, digests):
+                reported.append(compiled)
+
+        return [self._changes[compiled][0] for compiled in reported]
+
+    def _select(self, items, field, value):
+        ''' return the position of the first mapping in items whose field
+            reads as value, or None.  The positions are looked up in a
+            field value index of the list that is built on first use and
+            kept until the list or one of its items is modified.
+        '''
+        index = self._item_indexes.get(id(items))
+        if index is None or index[0] is not items:
+            index = (items, {})
+            self._item_indexes[id(items)] = index
+        texts = Yedit.selector_texts(value)
+        positions = index[1].get(field)
+        if positions is not None:
+            found = [positions[text] for text in texts if text in positions]
+            ind = min(found) if found else None
+            # a shared item may have been changed through an alias
+            if ind is not None and ind < len(items) and isinstance(items[ind], dict) and \
+               field in items[ind] and Yedit.selector_text(items[ind][field]) in texts:
+                return ind
+
+        positions = {}
+        for ind, item in enumerate(items):
+            if isinstance(item, dict) and field in item:
+                positions.setdefault(Yedit.selector_text(item[field]), ind)
+        index[1][field] = positions
+
+        found = [positions[text] for text in texts if text in positions]
+        return min(found) if found else None
+
+    def _member_index(self, items):
+        ''' return the digests of the items of a list of the document and
+            how often each digest occurs.  Built on first use, kept up to
+            date by _list_edit() and dropped when anything else modifies
+            the list or one of its items.
+        '''
+        index = self._member_indexes.get(id(items))
+        if index is None or index[0] is not items:
+            digests = [self.tree_hash(item) for item in items]
+            counts = {}
+            for digest in digests:
+                counts[digest] = counts.get(digest, 0) + 1
+            # links the items to the list so changes through aliases drop the index
+            self.tree_hash(items)
+            index = (items, digests, counts)
+            self._member_indexes[id(items)] = index
+
+        return index
+
+    def _index_of(self, items, value):
+        ''' return the position of the first item of a list of the document
+            equal to value, or None.  Items are only compared when their
+            digest matches the digest of value.
+        '''
+        _, digests, counts = self._member_index(items)
+        digest = Yedit.value_hash(value)
+        if not counts.get(digest):
+            return None
+
+        ind = digests.index(digest)
+        while items[ind] != value:
+            # a digest collision
+            try:
+                ind = digests.index(digest, ind + 1)
+            except ValueError:
+                return None
+
+        return ind
+
+    # pylint: disable=too-many-arguments
+    def _list_edit(self, path, items, action, ind=None, value=None):
+        ''' append, insert, replace or pop an item of the list at path, or
+            extend it with the list value, updating its membership index
+            instead of dropping it
+        '''
+        index = self._member_indexes.pop(id(items), None)
+        self._touch(path)
+        if action == 'append':
+            items.append(value)
+        elif action == 'extend':
+            items.extend(value)
+        elif action == 'insert':
+            items.insert(ind, value)
+        elif action == 'replace':
+            items[ind] = value
+        else:
+            items.pop(ind)
+
+        if index is None:
+            return
+
+        _, digests, counts = index
+        if action in ['replace', 'pop']:
+            digest = digests.pop(ind) if action == 'pop' else digests[ind]
+            counts[digest] -= 1
+            if not counts[digest]:
+                del counts[digest]
+        if action == 'extend':
+            for item in value:
+                digest = Yedit.value_hash(item)
+                digests.append(digest)
+                counts[digest] = counts.get(digest, 0) + 1
+        elif action != 'pop':
+            digest = Yedit.value_hash(value)
+            if action == 'append':
+                digests.append(digest)
+            elif action == 'insert':
+                digests.insert(ind, digest)
+            else:
+                digests[ind] = digest
+            counts[digest] = counts.get(digest, 0) + 1
+        self._member_indexes[id(items)] = index
+
+    def _resolve(self, key):
+        ''' return key with its selectors replaced by the positions of the
+            items they select, key itself when it has none, or None when a
+            selector matches nothing
+        '''
+        path = Yedit.compile_key(key, self.separator)
+        if not path or not [seg for seg in path if isinstance(seg, tuple)]:
+            return key
+        if Yedit.is_pattern(path):
+            raise YeditException('Key paths with wildcards can only be read or put: {0}'.format(key))
+
+        data = self.yaml_dict
+        resolved = []
+        for seg in path:
+            if isinstance(seg, tuple):
+                seg = self._select(data, *seg) if isinstance(data, list) else None
+                if seg is None:
+                    return None
+            resolved.append(seg)
+            data = Yedit.walk_path(data, (seg,))
+
+        return tuple(resolved)
+
+    def _resolve_or_raise(self, key):
+        ''' return the resolved key for an edit that cannot create list items '''
+        path = self._resolve(key)
+        if path is None:
+            raise YeditException('No list item matches the selectors of key path: {0}'.format(key))
+
+        return path
+
     def get(self, key):
-        ''' get a specified key'''
+        ''' get a specified key, or the list of the values a key with
+            wildcards matches
+        '''
+        path = Yedit.compile_key(key, self.separator)
+        if Yedit.is_pattern(path):
+            return [parent[seg] for parent, seg, _ in Yedit.match_path(self.yaml_dict, path, select=self._select)]
+
+        key = self._resolve(key)
+        if key is None:
+            return None
+
         try:
             entry = Yedit.get_entry(self.yaml_dict, key, self.separator)
         except KeyError:
@@ -539,6 +2162,10 @@ class Yedit(object):
 
     def pop(self, path, key_or_item):
         ''' remove a key, value pair from a dict or an item for a list'''
+        path = self._resolve(path)
+        if path is None:
+            return (False, self.yaml_dict)
+
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
@@ -551,6 +2178,7 @@ class Yedit(object):
             # AUDIT:maybe-no-member makes sense due to fuzzy types
             # pylint: disable=maybe-no-member
             if key_or_item in entry:
+                self._touch(path)
                 entry.pop(key_or_item)
                 return (True, self.yaml_dict)
             return (False, self.yaml_dict)
@@ -558,19 +2186,21 @@ class Yedit(object):
         elif isinstance(entry, list):
             # AUDIT:maybe-no-member makes sense due to fuzzy types
             # pylint: disable=maybe-no-member
-            ind = None
-            try:
-                ind = entry.index(key_or_item)
-            except ValueError:
+            ind = self._index_of(entry, key_or_item)
+            if ind is None:
                 return (False, self.yaml_dict)
 
-            entry.pop(ind)
+            self._list_edit(path, entry, 'pop', ind)
             return (True, self.yaml_dict)
 
         return (False, self.yaml_dict)
 
     def delete(self, path, index=None, value=None):
         ''' remove path from a dict'''
+        path = self._resolve(path)
+        if path is None:
+            return (False, self.yaml_dict)
+
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
@@ -579,6 +2209,14 @@ class Yedit(object):
         if entry is None:
             return (False, self.yaml_dict)
 
+        if value is not None and isinstance(entry, list) and Yedit.compile_key(path, self.separator) == ():
+            ind = self._index_of(entry, value)
+            if ind is None:
+                return (False, self.yaml_dict)
+            self._list_edit(path, entry, 'pop', ind)
+            return (True, self.yaml_dict)
+
+        self._touch(path)
         result = Yedit.remove_entry(self.yaml_dict, path, index, value, self.separator)
         if not result:
             return (False, self.yaml_dict)
@@ -587,15 +2225,17 @@ class Yedit(object):
 
     def exists(self, path, value):
         ''' check if value exists at path'''
+        path = self._resolve(path)
+        if path is None:
+            return False
+
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
             entry = None
 
         if isinstance(entry, list):
-            if value in entry:
-                return True
-            return False
+            return self._index_of(entry, value) is not None
 
         elif isinstance(entry, dict):
             if isinstance(value, dict):
@@ -614,6 +2254,7 @@ class Yedit(object):
 
     def append(self, path, value):
         '''append value to a list'''
+        path = self._resolve_or_raise(path)
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
@@ -628,11 +2269,35 @@ class Yedit(object):
         # AUDIT:maybe-no-member makes sense due to loading data from
         # a serialized format.
         # pylint: disable=maybe-no-member
-        entry.append(value)
+        self._list_edit(path, entry, 'append', value=value)
         return (True, self.yaml_dict)
 
     def insert(self, path, value, index=0):
         '''insert value to a list'''
+        path = self._resolve_or_raise(path)
+        try:
+            entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
+        except KeyError:
+            entry = None
+
+        if entry is None:
+            self.put(path, [])
+            entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
+        if not isinstance(entry, list):
+            return (False, self.yaml_dict)
+
+        self._list_edit(path, entry, 'insert', index, value)
+        return (True, self.yaml_dict)
+
+    def _bulk_entry(self, path, values):
+        ''' return the list at path for the bulk list edits, creating it when
+            it does not exist, or None when path holds something else
+        '''
+        if not isinstance(values, list):
+            raise YeditException('Bulk list edits expect a list of values. ' +
+                                 'value=[{0}] type=[{1}]'.format(values, type(values)))
+
+        path = self._resolve_or_raise(path)
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
@@ -641,15 +2306,100 @@ class Yedit(object):
         if entry is None:
             self.put(path, [])
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
+        if not isinstance(entry, list):
+            return None
+        return entry
+
+    def extend(self, path, values):
+        '''append each of values to a list'''
+        entry = self._bulk_entry(path, values)
+        if entry is None or not values:
+            return (False, self.yaml_dict)
+
+        self._list_edit(path, entry, 'extend', value=values)
+        return (True, self.yaml_dict)
+
+    def extend_unique(self, path, values):
+        ''' append the values a list does not hold yet, in order.  Values are
+            only compared with the items their digest matches.
+        '''
+        entry = self._bulk_entry(path, values)
+        if entry is None:
+            return (False, self.yaml_dict)
+
+        _, digests, counts = self._member_index(entry)
+        wanted = [Yedit.value_hash(value) for value in values]
+        members = {}
+        if any(digest in counts for digest in wanted):
+            for item, digest in zip(entry, digests):
+                members.setdefault(digest, []).append(item)
+        added = []
+        for value, digest in zip(values, wanted):
+            same = members.setdefault(digest, [])
+            # equal digests may still be unequal values, nan for one
+            if not any(item == value for item in same):
+                same.append(value)
+                added.append(value)
+
+        if not added:
+            return (False, self.yaml_dict)
+
+        self._list_edit(path, entry, 'extend', value=added)
+        return (True, self.yaml_dict)
+
+    def remove_many(self, path, values):
+        ''' remove every item of a list equal to one of values.  Items are
+            only compared with the values their digest matches.
+        '''
+        if not isinstance(values, list):
+            raise YeditException('Bulk list edits expect a list of values. ' +
+                                 'value=[{0}] type=[{1}]'.format(values, type(values)))
+
+        path = self._resolve(path)
+        if path is None:
+            return (False, self.yaml_dict)
+
+        try:
+            entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
+        except KeyError:
+            entry = None
+
         if not isinstance(entry, list):
             return (False, self.yaml_dict)
 
-        entry.insert(index, value)
+        removed = {}
+        for value in values:
+            removed.setdefault(Yedit.value_hash(value), []).append(value)
+        index = self._member_index(entry)
+        kept = [ind for ind, digest in enumerate(index[1])
+                if not any(entry[ind] == value for value in removed.get(digest, ()))]
+        if len(kept) == len(entry):
+            return (False, self.yaml_dict)
+
+        self._member_indexes.pop(id(entry), None)
+        self._touch(path)
+        comments = getattr(entry, 'ca', None)
+        if comments is not None:
+            # keep the comments with the items they follow
+            moved = dict((new, comments.items[old]) for new, old in enumerate(kept) if old in comments.items)
+            comments.items.clear()
+            comments.items.update(moved)
+        items = [entry[ind] for ind in kept]
+        # bypass CommentedSeq item bookkeeping, it does not handle slices
+        list.__delitem__(entry, slice(None, None))
+        list.extend(entry, items)
+
+        digests = [index[1][ind] for ind in kept]
+        counts = {}
+        for digest in digests:
+            counts[digest] = counts.get(digest, 0) + 1
+        self._member_indexes[id(entry)] = (entry, digests, counts)
         return (True, self.yaml_dict)
 
     # pylint: disable=too-many-arguments
     def update(self, path, value, index=None, curr_value=None):
         ''' put path, value into a dict '''
+        path = self._resolve_or_raise(path)
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
@@ -662,6 +2412,7 @@ class Yedit(object):
                 raise YeditException('Cannot replace key, value entry in dict with non-dict type. ' +
                                      'value=[{0}] type=[{1}]'.format(value, type(value)))
 
+            self._touch(path)
             entry.update(value)
             return (True, self.yaml_dict)
 
@@ -670,24 +2421,22 @@ class Yedit(object):
             # pylint: disable=maybe-no-member
             ind = None
             if curr_value:
-                try:
-                    ind = entry.index(curr_value)
-                except ValueError:
+                ind = self._index_of(entry, curr_value)
+                if ind is None:
                     return (False, self.yaml_dict)
 
             elif index is not None:
                 ind = index
 
             if ind is not None and entry[ind] != value:
-                entry[ind] = value
+                self._list_edit(path, entry, 'replace', ind, value)
                 return (True, self.yaml_dict)
 
             # see if it exists in the list
-            try:
-                ind = entry.index(value)
-            except ValueError:
+            ind = self._index_of(entry, value)
+            if ind is None:
                 # doesn't exist, append it
-                entry.append(value)
+                self._list_edit(path, entry, 'append', value=value)
                 return (True, self.yaml_dict)
 
             # already exists, return
@@ -695,32 +2444,68 @@ class Yedit(object):
                 return (False, self.yaml_dict)
         return (False, self.yaml_dict)
 
+    def _put_matches(self, path, value):
+        ''' put value at every location a key with wildcards matches, found
+            in one traversal of the document
+        '''
+        matches = Yedit.match_path(self.yaml_dict, path, create=True, select=self._select)
+        replaced = set()
+        own_batch = self.begin()
+        try:
+            for parent, seg, concrete in matches:
+                # a match inside a value that was just replaced is gone
+                if [ind for ind in range(len(concrete)) if concrete[:ind] in replaced]:
+                    continue
+
+                entry = parent.get(seg) if isinstance(parent, dict) else parent[seg]
+                if self.equals(entry, value):
+                    continue
+
+                self._touch(concrete, scalar=entry is not None and
+                            not isinstance(entry, (dict, list)) and not isinstance(value, (dict, list)))
+                # the same value in many places would be dumped as aliases
+                parent[seg] = copy.deepcopy(value) if replaced else value
+                replaced.add(concrete)
+        except Exception:
+            if own_batch:
+                self.rollback()
+            raise
+
+        if own_batch:
+            self.commit()
+
+        return (bool(replaced), self.yaml_dict)
+
     def put(self, path, value):
-        ''' put path, value into a dict '''
+        ''' put path, value into a dict.  A key with wildcards puts value
+            at every location it matches.
+        '''
+        compiled = Yedit.compile_key(path, self.separator)
+        if Yedit.is_pattern(compiled):
+            return self._put_matches(compiled, value)
+
+        path = self._resolve_or_raise(path)
         try:
             entry = Yedit.get_entry(self.yaml_dict, path, self.separator)
         except KeyError:
             entry = None
 
-        if entry == value:
+        if self.equals(entry, value):
             return (False, self.yaml_dict)
 
-        # deepcopy didn't work
-        # Try to use ruamel.yaml and fallback to pyyaml
+        own_batch = self.begin()
         try:
-            tmp_copy = yaml.load(yaml.round_trip_dump(self.yaml_dict,
-                                                      default_flow_style=False),
-                                 yaml.RoundTripLoader)
-        except AttributeError:
-            tmp_copy = copy.deepcopy(self.yaml_dict)
+            self._touch(path, scalar=entry is not None and
+                        not isinstance(entry, (dict, list)) and not isinstance(value, (dict, list)))
+            result = Yedit.add_entry(self.yaml_dict, path, value, self.separator)
+        except Exception:
+            if own_batch:
+                self.rollback()
+            raise
 
-        # set the format attributes if available
-        try:
-            tmp_copy.fa.set_block_style()
-        except AttributeError:
-            pass
+        if own_batch:
+            self.commit()
 
-        result = Yedit.add_entry(tmp_copy, path, value, self.separator)
         if result is None:
             return (False, self.yaml_dict)
 
@@ -734,31 +2519,25 @@ class Yedit(object):
 
             return (False, self.yaml_dict)
 
-        self.yaml_dict = tmp_copy
-
         return (True, self.yaml_dict)
 
     def create(self, path, value):
         ''' create a yaml file '''
         if not self.file_exists():
-            # deepcopy didn't work
-            # Try to use ruamel.yaml and fallback to pyyaml
+            path = self._resolve_or_raise(path)
+            own_batch = self.begin()
             try:
-                tmp_copy = yaml.load(yaml.round_trip_dump(self.yaml_dict,
-                                                          default_flow_style=False),
-                                     yaml.RoundTripLoader)
-            except AttributeError:
-                tmp_copy = copy.deepcopy(self.yaml_dict)
+                self._touch(path)
+                result = Yedit.add_entry(self.yaml_dict, path, value, self.separator)
+            except Exception:
+                if own_batch:
+                    self.rollback()
+                raise
 
-            # set the format attributes if available
-            try:
-                tmp_copy.fa.set_block_style()
-            except AttributeError:
-                pass
+            if own_batch:
+                self.commit()
 
-            result = Yedit.add_entry(tmp_copy, path, value, self.separator)
             if result is not None:
-                self.yaml_dict = tmp_copy
                 return (True, self.yaml_dict)
 
         return (False, self.yaml_dict)
@@ -810,48 +2589,322 @@ class Yedit(object):
     def process_edits(edits, yamlfile):
         '''run through a list of edits and process them one-by-one'''
         results = []
-        for edit in edits:
-            value = Yedit.parse_value(edit['value'], edit.get('value_type', ''))
-            if edit.get('action') == 'update':
-                # pylint: disable=line-too-long
-                curr_value = Yedit.get_curr_value(
-                    Yedit.parse_value(edit.get('curr_value')),
-                    edit.get('curr_value_format'))
+        # The edits are applied as one batch: either all of them are kept
+        # or the document is rolled back to its state before the first one.
+        own_batch = yamlfile.begin()
+        try:
+            for edit in edits:
+                value = Yedit.parse_value(edit['value'], edit.get('value_type', ''))
+                if edit.get('action') == 'update':
+                    # pylint: disable=line-too-long
+                    curr_value = Yedit.get_curr_value(
+                        Yedit.parse_value(edit.get('curr_value')),
+                        edit.get('curr_value_format'))
 
-                rval = yamlfile.update(edit['key'],
-                                       value,
-                                       edit.get('index'),
-                                       curr_value)
+                    rval = yamlfile.update(edit['key'],
+                                           value,
+                                           edit.get('index'),
+                                           curr_value)
 
-            elif edit.get('action') == 'append':
-                rval = yamlfile.append(edit['key'], value)
+                elif edit.get('action') == 'append':
+                    rval = yamlfile.append(edit['key'], value)
 
-            elif edit.get('action') == 'insert':
-                rval = yamlfile.insert(edit['key'], value, edit['index'])
+                elif edit.get('action') == 'insert':
+                    rval = yamlfile.insert(edit['key'], value, edit['index'])
 
-            else:
-                rval = yamlfile.put(edit['key'], value)
+                elif edit.get('action') == 'extend':
+                    rval = yamlfile.extend(edit['key'], value)
+
+                elif edit.get('action') == 'extend_unique':
+                    rval = yamlfile.extend_unique(edit['key'], value)
+
+                elif edit.get('action') == 'remove_many':
+                    rval = yamlfile.remove_many(edit['key'], value)
+
+                else:
+                    rval = yamlfile.put(edit['key'], value)
+
+                if rval[0]:
+                    results.append({'key': edit['key'], 'edit': rval[1]})
+        except Exception:
+            if own_batch:
+                yamlfile.rollback()
+            raise
 
-            if rval[0]:
-                results.append({'key': edit['key'], 'edit': rval[1]})
+        if own_batch:
+            yamlfile.commit()
 
         return {'changed': len(results) > 0, 'results': results}
 
-    # pylint: disable=too-many-return-statements,too-many-branches
     @staticmethod
     def run_ansible(params):
         '''perform the idempotent crud operations'''
-        yamlfile = Yedit(filename=params['src'],
-                         backup=params['backup'],
-                         content_type=params['content_type'],
-                         backup_ext=params['backup_ext'],
-                         separator=params['separator'])
+        if params.get('paths'):
+            return Yedit.run_ansible_paths(params)
 
+        try:
+            return Yedit._run_file(params)
+        finally:
+            Yedit.sync_pending()
+
+    @staticmethod
+    def expand_paths(paths):
+        '''expand a list of files and glob patterns into a list of files.
+           Raises YeditException when a pattern matches no file.
+        '''
+        filenames = []
+        seen = set()
+        for path in paths:
+            path = os.path.expanduser(path)
+            matches = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+            if not matches:
+                raise YeditException('No files match the pattern {0}.'.format(path))
+            for filename in matches:
+                if filename not in seen:
+                    seen.add(filename)
+                    filenames.append(filename)
+
+        return filenames
+
+    @staticmethod
+    def run_ansible_paths(params):
+        '''run the same operation against every file of params['paths'].
+           Files are spread over a pool of worker processes and the
+           per-file results are aggregated.
+        '''
+        try:
+            filenames = Yedit.expand_paths(params['paths'])
+        except YeditException as err:
+            return {'failed': True, 'msg': str(err), 'state': params['state']}
+
+        jobs = [dict(params, src=filename, paths=None) for filename in filenames]
+        workers = min(params.get('workers') or multiprocessing.cpu_count(), len(jobs))
+
+        if workers > 1:
+            # fork so the workers inherit this module instead of re-importing it
+            context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+            pool = context.Pool(workers)
+            try:
+                outcomes = pool.map(_run_path, jobs, max(1, len(jobs) // (workers * 4)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            outcomes = [_run_path(job) for job in jobs]
+
+        results = []
+        for rval, pending_syncs in outcomes:
+            Yedit._pending_syncs.extend(pending_syncs)
+            results.append(rval)
+        Yedit.sync_pending()
+
+        changed_count = len([rval for rval in results if rval.get('changed')])
+        failed_count = len([rval for rval in results if rval.get('failed')])
+        rval = {'changed': changed_count > 0,
+                'changed_count': changed_count,
+                'failed_count': failed_count,
+                'results': results,
+                'state': params['state']}
+        if failed_count:
+            rval['failed'] = True
+            rval['msg'] = 'Failed to process {0} of {1} files.'.format(failed_count, len(results))
+
+        return rval
+
+    @staticmethod
+    def _lookup_key(params):
+        '''answer state=list for a key from the sidecar index or the parser
+           events.  Returns None when the file has to be loaded.
+        '''
+        index = None
+        if params.get('path_index'):
+            index = YeditIndex(params['src'],
+                               params.get('path_index_depth') or YeditIndex.default_depth,
+                               params.get('path_index_max_entries') or YeditIndex.default_max_entries)
+            found, rval = index.get(params['key'], params['separator'], params.get('preserve_format', True))
+            if found:
+                return {'changed': False, 'result': rval, 'state': 'list', 'engine': 'index',
+                        'path_index': index.stats()}
+
+        found, rval = Yedit.stream_get(params['src'], params['key'], params['separator'],
+                                       params.get('preserve_format', True))
+        if found:
+            rval = {'changed': False, 'result': rval, 'state': 'list', 'engine': 'stream'}
+            if index:
+                rval['path_index'] = index.stats()
+            return rval
+
+        return None
+
+    @staticmethod
+    def _run_file(params):
+        '''run the requested state against a single file or content, holding
+           the lock of src for the whole run when asked to
+        '''
+        lock = None
+        if params.get('lock') and params['src'] and params['state'] != 'list':
+            lock = YeditLock(params['src'], params.get('lock_timeout', YeditLock.default_timeout))
+            try:
+                lock.acquire()
+            except YeditException as err:
+                return {'failed': True, 'msg': str(err), 'lock': lock.stats()}
+            except (IOError, OSError) as err:
+                return {'failed': True, 'msg': 'Error opening the lock file {0}: {1}'.format(lock.lock_filename, err),
+                        'lock': lock.stats()}
+
+        try:
+            rval = Yedit._run_document(params)
+        finally:
+            if lock:
+                lock.release()
+
+        if lock:
+            rval['lock'] = lock.stats()
+
+        return rval
+
+    @staticmethod
+    def _lock_target(filename):
+        ''' return the lock writers take on filename itself before replacing
+            it, held on the file filename names now, or None when it cannot
+            be taken
+        '''
+        while os.path.exists(filename):
+            lock = YeditLock(filename, YeditLock.default_timeout, filename)
+            try:
+                lock.acquire()
+            except (IOError, OSError, YeditException):
+                return None
+            if lock.holds(filename):
+                return lock
+            # the file was replaced while the lock was waited for
+            lock.release()
+
+        return None
+
+    @staticmethod
+    def _run_document(params):
+        '''run the requested state against a single file or content.
+           Edits lost to a concurrent writer are loaded and applied again, a
+           few times, holding the lock writers take on the file before they
+           replace it.  With src, the sha1 of the file the run read or wrote
+           is returned as checksum.
+        '''
+        expected_checksum = params.get('expected_checksum')
+
+        # A query that does not parse fails before the file is read
+        if params['state'] == 'list' and params.get('query'):
+            try:
+                YeditQuery.compile(params['query'])
+            except YeditException as err:
+                return {'failed': True, 'msg': str(err)}
+
+        # Edits that already ran on this exact file have nothing to do
+        journal = None
+        edit_hash = None
+        if params.get('journal') and params['src'] and expected_checksum is None:
+            edit_hash = YeditJournal.edit_hash(params)
+        if edit_hash:
+            journal = YeditJournal(params['src'])
+            if journal.converged(edit_hash):
+                return {'changed': False, 'result': [], 'state': params['state'], 'journal': 'hit',
+                        'checksum': journal.checksum}
+
+        # Appending to the list that ends the file does not need it parsed
+        if params['state'] == 'present' and params.get('append') and params['src'] and \
+           params['value'] is not None and not params['content'] and not params['backup'] and \
+           not params.get('document') and params['content_type'] == 'yaml' and expected_checksum is None:
+            value = Yedit.parse_value(params['value'], params['value_type'])
+            durability = params.get('durability') or 'full'
+            if Yedit.append_in_place(params['src'], params['key'], value, params['separator'], durability):
+                return {'changed': True, 'result': [{'key': params['key'], 'edit': None}],
+                        'state': 'present', 'durability': durability, 'engine': 'append',
+                        'checksum': Yedit.checksum(params['src'])}
+
+        # Reading a single key does not need the whole file parsed
+        if params['state'] == 'list' and params['src'] and params['key'] and \
+           not params['content'] and not params.get('document') and params['content_type'] == 'yaml':
+            rval = Yedit._lookup_key(params)
+            if rval is not None:
+                if params.get('query'):
+                    rval['result'] = YeditQuery.compile(params['query']).search(rval['result'])
+                return rval
+
+        retries = params.get('retries')
+        if retries is None:
+            retries = Yedit.conflict_retries
+
+        attempt = 0
+        target_lock = None
+        try:
+            while True:
+                yamlfile = Yedit(filename=params['src'],
+                                 backup=params['backup'],
+                                 content_type=params['content_type'],
+                                 backup_ext=params['backup_ext'],
+                                 separator=params['separator'],
+                                 durability=params.get('durability') or 'full',
+                                 preserve_format=params.get('preserve_format', True),
+                                 document=params.get('document'),
+                                 cache_dir=params.get('cache_dir'),
+                                 cache_size=params.get('cache_size'),
+                                 detect_conflicts=bool(params['src']) and not params['content'])
+
+                try:
+                    rval = Yedit._run_ansible(params, yamlfile)
+                    break
+                except YeditConflict as err:
+                    # with an expected checksum the conflict is the answer
+                    if expected_checksum is not None or attempt >= retries:
+                        return {'failed': True, 'msg': str(err), 'conflicts': attempt + 1}
+
+                # Holding the lock writers take before replacing the file, no
+                # other writer gets in between loading and writing it again.
+                if target_lock is None:
+                    target_lock = Yedit._lock_target(params['src'])
+                if target_lock is None:
+                    time.sleep(random.uniform(0, Yedit.conflict_backoff * 2 ** attempt))
+                attempt += 1
+        finally:
+            if target_lock:
+                target_lock.release()
+
+        if not rval.get('failed'):
+            if attempt:
+                rval['conflicts'] = attempt
+            if params['src']:
+                rval['durability'] = yamlfile.durability
+                if params['state'] != 'list':
+                    rval['checksum'] = yamlfile.last_checksum
+            if yamlfile.engine:
+                rval['engine'] = yamlfile.engine
+            if yamlfile.cache:
+                rval['cache'] = yamlfile.cache.stats()
+            if rval.get('changed'):
+                rval['changed_paths'] = yamlfile.changed_paths()
+            if journal:
+                journal.record(edit_hash, yamlfile.last_checksum)
+                rval['journal'] = 'miss'
+
+        return rval
+
+    # pylint: disable=too-many-return-statements,too-many-branches
+    @staticmethod
+    def _run_ansible(params, yamlfile):
+        '''run the requested state against the file or content'''
         state = params['state']
 
         if params['src']:
             rval = yamlfile.load()
 
+            # the edits are only made on the bytes that were just parsed
+            expected_checksum = params.get('expected_checksum')
+            if expected_checksum is not None and yamlfile.last_checksum != expected_checksum:
+                return {'failed': True, 'checksum': yamlfile.last_checksum,
+                        'msg': 'The checksum of {0} is {1}, expected {2}.'.format(params['src'],
+                                                                                   yamlfile.last_checksum,
+                                                                                   expected_checksum)}
+
             if yamlfile.yaml_dict is None and state != 'present':
                 return {'failed': True,
                         'msg': 'Error opening file [{0}].  Verify that the '.format(params['src']) +
@@ -865,6 +2918,9 @@ class Yedit(object):
             if params['key']:
                 rval = yamlfile.get(params['key'])
 
+            if params.get('query'):
+                rval = YeditQuery.compile(params['query']).search(rval)
+
             return {'changed': False, 'result': rval, 'state': state}
 
         elif state == 'absent':
@@ -877,10 +2933,11 @@ class Yedit(object):
             else:
                 rval = yamlfile.delete(params['key'], params['index'], params['value'])
 
-            if rval[0] and params['src']:
-                yamlfile.write()
+            changed = rval[0]
+            if changed and params['src']:
+                changed = yamlfile.write()[0]
 
-            return {'changed': rval[0], 'result': rval[1], 'state': state}
+            return {'changed': changed, 'result': rval[1], 'state': state}
 
         elif state == 'present':
             # check if content is different than what is in the file
@@ -888,10 +2945,12 @@ class Yedit(object):
                 content = Yedit.parse_value(params['content'], params['content_type'])
 
                 # We had no edits to make and the contents are the same
-                if yamlfile.yaml_dict == content and \
+                if yamlfile.equals(yamlfile.yaml_dict, content) and \
                    params['value'] is None:
                     return {'changed': False, 'result': yamlfile.yaml_dict, 'state': state}
 
+                # the whole document is replaced
+                yamlfile._touch('')
                 yamlfile.yaml_dict = content
 
             # If we were passed a key, value then
@@ -917,6 +2976,12 @@ class Yedit(object):
                     _edit['action'] = 'insert'
                     _edit['index'] = params['index']
 
+                else:
+                    for action in ['extend', 'extend_unique', 'remove_many']:
+                        if params.get(action):
+                            _edit['action'] = action
+                            break
+
                 edits.append(_edit)
 
             elif params['edits'] is not None:
@@ -927,7 +2992,7 @@ class Yedit(object):
 
                 # if there were changes and a src provided to us we need to write
                 if results['changed'] and params['src']:
-                    yamlfile.write()
+                    results['changed'] = yamlfile.write()[0]
 
                 return {'changed': results['changed'], 'result': results['results'], 'state': state}
 
@@ -942,11 +3007,975 @@ class Yedit(object):
             return {'changed': False, 'result': yamlfile.yaml_dict, 'state': state}
         return {'failed': True, 'msg': 'Unkown state passed'}
 
+class YeditIndex(object):
+    ''' A sidecar index of a yaml or json file mapping key paths, down to a
+        given depth, to the byte range of their values.  A lookup parses only
+        the fragment of the file holding the value.  The index is trusted
+        while the file's stat signature is unchanged, revalidated with the
+        content hash when it changed and rebuilt when the hash differs.
+    '''
+    version = 1
+    default_depth = 3
+    default_max_entries = 10000
+    re_maybe_not_str = re.compile(r'^(?:[-+.0-9~]|(?:null|true|false|yes|no|on|off|y|n)$)', re.I)
+
+    def __init__(self, filename, depth=default_depth, max_entries=default_max_entries):
+        self.filename = filename
+        self.index_filename = '{0}.yedit_index'.format(filename)
+        self.depth = depth
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.rebuilt = False
+        self._index = None
+
+    def stats(self):
+        ''' return the counters of this index '''
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'rebuilt': self.rebuilt,
+                'entries': len(self._index['entries']) if self._index else 0}
+
+    def _save(self):
+        ''' write the index to its sidecar file atomically '''
+        tmp_filename = '{0}.yedit.{1}'.format(self.index_filename, os.getpid())
+        with open(tmp_filename, 'w') as ifd:
+            json.dump(self._index, ifd, separators=(',', ':'))
+        os.rename(tmp_filename, self.index_filename)
+
+    def load(self):
+        ''' load the sidecar index, revalidating or rebuilding it when stale '''
+        signature = Yedit.file_signature(self.filename)
+        if signature is None:
+            raise IOError(errno.ENOENT, 'No such file', self.filename)
+        signature = list(signature)
+        try:
+            with open(self.index_filename) as ifd:
+                index = json.load(ifd)
+        except (IOError, OSError, ValueError):
+            index = None
+
+        if index and [index.get('version'), index.get('depth'), index.get('max_entries')] == \
+           [YeditIndex.version, self.depth, self.max_entries]:
+            if index['signature'] == signature:
+                self._index = index
+                return
+
+            if index['sha256'] == Yedit.file_checksum(self.filename):
+                index['signature'] = signature
+                self._index = index
+                self._save()
+                return
+
+        self.build(signature)
+
+    # pylint: disable=too-many-locals,too-many-branches
+    def build(self, signature):
+        ''' index the file from the marks of its parser events '''
+        with open(self.filename, 'rb') as yfd:
+            raw = yfd.read()
+        text = raw.decode('utf-8')
+
+        complete = True
+        spans = []
+        stack = []
+        for event in yaml.parse(text, Loader=FAST_LOADER):
+            if isinstance(event, yaml.events.DocumentEndEvent):
+                break
+            if isinstance(event, (yaml.events.StreamStartEvent, yaml.events.DocumentStartEvent)):
+                continue
+
+            if isinstance(event, yaml.events.CollectionEndEvent):
+                frame = stack.pop()
+                if frame['span'] is not None:
+                    frame['span'][1] = event.end_mark.index
+                if stack and stack[-1]['mapping']:
+                    stack[-1]['expect_key'] = not frame['is_key']
+                continue
+
+            parent = stack[-1] if stack else None
+            is_key = parent is not None and parent['mapping'] and parent['expect_key']
+            path = span = None
+            if is_key:
+                parent['expect_key'] = False
+                parent['key'] = None
+                if isinstance(event, yaml.events.ScalarEvent):
+                    if event.value == '<<':
+                        # merged keys are not in the file under their path
+                        complete = False
+                    elif event.style or not YeditIndex.re_maybe_not_str.match(event.value) or \
+                            isinstance(Yedit.load_text(event.value), str):
+                        parent['key'] = event.value
+            else:
+                if parent is None:
+                    path = ()
+                elif parent['path'] is not None and not parent['mapping']:
+                    path = parent['path'] + (parent['position'],)
+                elif parent['path'] is not None and parent['key'] is not None:
+                    path = parent['path'] + (parent['key'],)
+
+                if parent is not None and parent['mapping']:
+                    parent['expect_key'] = True
+                elif parent is not None:
+                    parent['position'] += 1
+
+                if isinstance(event, yaml.events.AliasEvent):
+                    complete = False
+                elif path and len(path) <= self.depth:
+                    span = [event.start_mark.index, event.end_mark.index, event.start_mark.column, path]
+                    spans.append(span)
+
+            if isinstance(event, yaml.events.CollectionStartEvent):
+                stack.append({'path': path if path is not None and len(path) < self.depth else None,
+                              'mapping': isinstance(event, yaml.events.MappingStartEvent),
+                              'expect_key': True,
+                              'key': None,
+                              'position': 0,
+                              'is_key': is_key,
+                              'span': span})
+
+        if len(spans) > self.max_entries:
+            complete = False
+            spans = sorted(spans, key=lambda span: len(span[3]))[:self.max_entries]
+
+        # parser marks count characters, the index stores byte offsets
+        if len(raw) != len(text):
+            offsets = {}
+            position = byte_position = 0
+            for char_index in sorted(set([span[0] for span in spans] + [span[1] for span in spans])):
+                byte_position += len(text[position:char_index].encode('utf-8'))
+                position = char_index
+                offsets[char_index] = byte_position
+            for span in spans:
+                span[0], span[1] = offsets[span[0]], offsets[span[1]]
+
+        self._index = {'version': YeditIndex.version,
+                       'signature': signature,
+                       'sha256': hashlib.sha256(raw).hexdigest(),
+                       'depth': self.depth,
+                       'max_entries': self.max_entries,
+                       'complete': complete,
+                       'entries': dict((json.dumps(list(span[3])), span[:3]) for span in spans)}
+        self.rebuilt = True
+        self._save()
+
+    def get(self, key, sep='.', preserve_format=True):
+        ''' Look up key through the index.  Returns (True, value) or
+            (False, None) when the index cannot answer the lookup.
+        '''
+        path = Yedit.compile_key(key, sep)
+        if not path or [seg for seg in path if isinstance(seg, int) and seg < 0]:
+            self.misses += 1
+            return (False, None)
+
+        # selectors are walked in the fragment of the path before them
+        indexed = min([ind for ind, seg in enumerate(path) if isinstance(seg, tuple)] + [len(path), self.depth])
+        if not indexed:
+            self.misses += 1
+            return (False, None)
+
+        try:
+            if self._index is None:
+                self.load()
+
+            for length in range(indexed, 0, -1):
+                entry = self._index['entries'].get(json.dumps(list(path[:length])))
+                if entry is None:
+                    continue
+
+                start, end, column = entry
+                with open(self.filename, 'rb') as yfd:
+                    yfd.seek(start)
+                    fragment = ' ' * column + yfd.read(end - start).decode('utf-8')
+                if length < len(path) and not Yedit.is_pattern(path):
+                    # the rest of the path, in a fragment that can be most of
+                    # the file when the index was cut short, is walked in the
+                    # parser events instead of building the whole fragment
+                    found, value = Yedit.stream_lookup(fragment, path[length:], preserve_format)
+                    if found:
+                        self.hits += 1
+                        return (True, value)
+                data = Yedit.load_text(fragment, preserve_format)
+                self.hits += 1
+                if Yedit.is_pattern(path):
+                    return (True, [parent[seg] for parent, seg, _ in Yedit.match_path(data, path[length:])])
+                return (True, Yedit.walk_path(data, path[length:]))
+        except (IOError, OSError, ValueError, yaml.YAMLError):
+            self.misses += 1
+            return (False, None)
+
+        if self._index['complete']:
+            # every path down to the index depth is indexed, so the key is
+            # missing, and a key with wildcards matches nothing
+            self.hits += 1
+            return (True, [] if Yedit.is_pattern(path) else None)
+
+        self.misses += 1
+        return (False, None)
+
+
+class YeditLock(object):
+    ''' An exclusive lock on a stable lock file next to a file, held across
+        load, edit and write so concurrent runs do not lose each other's
+        updates.  flock has no timeout, so it is retried with exponential
+        backoff until timeout seconds have passed.  With lock_filename, that
+        file is locked instead.  A lock file this process already holds is
+        not waited for.
+    '''
+    default_timeout = 30
+    initial_delay = 0.01
+    max_delay = 0.1
+    _held = set()
+
+    def __init__(self, filename, timeout=default_timeout, lock_filename=None):
+        self.lock_filename = lock_filename or '{0}.yedit_lock'.format(filename)
+        self.timeout = timeout
+        self.attempts = 0
+        self.wait = 0.0
+        self._fd = None
+
+    def stats(self):
+        ''' return how long and how many times the lock was tried '''
+        return {'wait': round(self.wait, 3), 'attempts': self.attempts}
+
+    def acquire(self):
+        ''' take the lock or raise YeditException after timeout seconds '''
+        if self.lock_filename in YeditLock._held:
+            # flock would wait for the lock this process holds
+            self.attempts += 1
+            return
+
+        fd = os.open(self.lock_filename, os.O_RDONLY | os.O_CREAT, 0o644)
+        start = time.time()
+        delay = YeditLock.initial_delay
+        while True:
+            self.attempts += 1
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (IOError, OSError) as err:
+                if err.errno not in [errno.EAGAIN, errno.EACCES]:
+                    os.close(fd)
+                    raise
+
+            self.wait = time.time() - start
+            if self.timeout is not None and self.wait >= self.timeout:
+                os.close(fd)
+                raise YeditException('Timed out after {0} attempts waiting for the lock {1}.'.format(
+                    self.attempts, self.lock_filename))
+            remaining = self.timeout - self.wait if self.timeout is not None else delay
+            time.sleep(min(delay, YeditLock.max_delay, remaining))
+            delay *= 2
+
+        self.wait = time.time() - start
+        self._fd = fd
+        YeditLock._held.add(self.lock_filename)
+
+    def release(self):
+        ''' release the lock '''
+        if self._fd is None:
+            return
+
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        YeditLock._held.discard(self.lock_filename)
+
+    def holds(self, filename):
+        ''' return whether the lock is held on the file filename names now,
+            which is not the case once a lock file was replaced
+        '''
+        if self._fd is None:
+            return False
+
+        try:
+            locked, current = os.fstat(self._fd), os.stat(filename)
+        except (IOError, OSError):
+            return False
+
+        return (locked.st_dev, locked.st_ino) == (current.st_dev, current.st_ino)
+
+
+class YeditTempFile(object):
+    ''' The text stream a file is rewritten through.  What is written is
+        compared with the bytes of the file as it comes, and the temp file
+        is only created at the first difference, holding the bytes matched
+        so far, so rewriting a file with the same contents writes nothing.
+    '''
+
+    def __init__(self, filename, tmp_filename, digest=None):
+        self.filename = filename
+        self.tmp_filename = tmp_filename
+        self.digest = digest
+        # encoded as a file opened in text mode would be
+        self.encoding = locale.getpreferredencoding(False)
+        self._encoder = codecs.getincrementalencoder(self.encoding)()
+        self._matched = 0
+        self._tmp = None
+        try:
+            self._original = open(filename, 'rb')
+        except (IOError, OSError):
+            self._original = None
+            self._create()
+
+    def _create(self):
+        ''' create the temp file with the bytes of the file matched so far '''
+        self._tmp = open(self.tmp_filename, 'wb', Yedit.chunk_size)
+        if self._original is None:
+            return
+
+        self._original.seek(0)
+        remaining = self._matched
+        while remaining:
+            chunk = self._original.read(min(remaining, Yedit.chunk_size))
+            self._tmp.write(chunk)
+            remaining -= len(chunk)
+        self._original.close()
+        self._original = None
+
+    def _write_bytes(self, data):
+        ''' compare data with the file or write it to the temp file '''
+        if self.digest is not None:
+            self.digest.update(data)
+        if self._tmp is None:
+            if self._original.read(len(data)) == data:
+                self._matched += len(data)
+                return
+            self._create()
+        self._tmp.write(data)
+
+    def write(self, text):
+        ''' write text to the stream '''
+        self._write_bytes(self._encoder.encode(text))
+
+    def flush(self):
+        ''' nothing is buffered outside of the files '''
+        pass
+
+    def close(self, sync=False):
+        ''' end the contents.  Returns False, and leaves no temp file, when
+            they are the bytes of the file.  With sync, the temp file is
+            fsynced.
+        '''
+        self._write_bytes(self._encoder.encode('', True))
+        if self._tmp is None:
+            if not self._original.read(1):
+                self._original.close()
+                self._original = None
+                return False
+            self._create()
+
+        self._tmp.flush()  # flush internal buffers
+        if sync:
+            try:
+                os.fsync(self._tmp.fileno())  # ensure buffer content reached disk
+            except:
+                pass
+        self._tmp.close()
+        return True
+
+    def discard(self):
+        ''' close the files and remove the temp file after a failure '''
+        if self._original is not None:
+            self._original.close()
+            self._original = None
+        if self._tmp is not None:
+            self._tmp.close()
+            try:
+                os.unlink(self.tmp_filename)
+            except OSError:
+                pass
+
+
+class YeditJournal(object):
+    ''' A sidecar file recording, for each set of idempotent edits run on a
+        file, the hash of the file after the run.  Running the same edits on
+        a file with that hash again cannot change it.
+    '''
+    version = 1
+    max_entries = 64
+    edit_params = ['state', 'key', 'value', 'value_type', 'update', 'curr_value', 'curr_value_format',
+                   'index', 'extend_unique', 'remove_many', 'edits', 'separator', 'content_type',
+                   'document', 'preserve_format']
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal_filename = '{0}.yedit_journal'.format(filename)
+        self.checksum = None
+
+    @staticmethod
+    def edit_hash(params):
+        ''' return the hash of the normalized edits of params, or None when
+            running them twice could change the file
+        '''
+        if params['state'] != 'present' or params['content']:
+            return None
+        if params['value'] is not None:
+            if params.get('append') or params.get('insert') or params.get('extend'):
+                return None
+        elif not params.get('edits') or \
+                [edit for edit in params['edits'] if edit.get('action') in ['append', 'insert', 'extend']]:
+            return None
+
+        edits = json.dumps(dict((name, params.get(name)) for name in YeditJournal.edit_params),
+                           sort_keys=True, default=str)
+        return hashlib.sha256(edits.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        ''' return the recorded entries '''
+        try:
+            with open(self.journal_filename) as jfd:
+                journal = json.load(jfd, object_pairs_hook=collections.OrderedDict)
+        except (IOError, OSError, ValueError):
+            return collections.OrderedDict()
+
+        if not isinstance(journal, dict) or journal.get('version') != YeditJournal.version:
+            return collections.OrderedDict()
+        return journal.get('entries') or collections.OrderedDict()
+
+    def converged(self, edit_hash):
+        ''' return whether the edits last left the file as it is now '''
+        recorded = self._load().get(edit_hash)
+        if recorded is None:
+            return False
+
+        try:
+            self.checksum = Yedit.file_checksum(self.filename, 'sha1')
+        except (IOError, OSError):
+            return False
+
+        return self.checksum == recorded
+
+    def record(self, edit_hash, checksum):
+        ''' record checksum, the sha1 of the bytes the run wrote or, when it
+            did not write, of the bytes it read, as the file the edits left
+        '''
+        if checksum is None:
+            return
+        self.checksum = checksum
+
+        entries = self._load()
+        entries.pop(edit_hash, None)
+        entries[edit_hash] = self.checksum
+        while len(entries) > YeditJournal.max_entries:
+            entries.popitem(last=False)
+
+        tmp_filename = '{0}.yedit.{1}'.format(self.journal_filename, os.getpid())
+        try:
+            with open(tmp_filename, 'w') as jfd:
+                json.dump({'version': YeditJournal.version, 'entries': entries}, jfd, separators=(',', ':'))
+            os.rename(tmp_filename, self.journal_filename)
+        except (IOError, OSError):
+            pass
+
+
+class YeditCache(object):
+    ''' An on-disk cache of parsed documents, keyed by the hash of their text
+        and of the engine that parsed them.  Round-trip trees are pickled, the
+        plain data of the fast engine is stored as json.  Entries are written
+        atomically and the least recently used ones are evicted once the
+        cache grows past max_size bytes.
+    '''
+    default_max_size = 100 * 1024 * 1024
+    re_entry = re.compile(r'^[0-9a-f]{64}\.(?:pickle|json)$')
+
+    def __init__(self, directory, max_size=default_max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        ''' return the counters of this cache '''
+        return {'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def key(engine, contents):
+        ''' return the cache key of contents parsed by engine '''
+        digest = hashlib.sha256()
+        digest.update('{0}\0{1}\0'.format(engine, getattr(yaml, '__version__', '')).encode('utf-8'))
+        digest.update(contents.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _filename(self, key, fmt):
+        ''' return the file of an entry '''
+        return os.path.join(self.directory, '{0}.{1}'.format(key, fmt))
+
+    def get(self, key, fmt):
+        ''' return (True, data) for a cached entry or (False, None) '''
+        filename = self._filename(key, fmt)
+        try:
+            with open(filename, 'rb') as cfd:
+                # only entries written by this user are unpickled
+                if os.fstat(cfd.fileno()).st_uid != os.getuid():
+                    raise IOError('{0} is not owned by the current user'.format(filename))
+                data = cfd.read()
+            # the modification time orders entries for eviction
+            os.utime(filename, None)
+            data = pickle.loads(data) if fmt == 'pickle' else json.loads(data.decode('utf-8'))
+        except Exception:  # pylint: disable=broad-except
+            self.misses += 1
+            return (False, None)
+
+        self.hits += 1
+        return (True, data)
+
+    def put(self, key, fmt, data):
+        ''' store data under key.  Returns False when it cannot be cached. '''
+        try:
+            if fmt == 'pickle':
+                contents = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            else:
+                contents = json.dumps(data, separators=(',', ':'))
+                # keys and types json does not keep are not cached
+                if json.loads(contents) != data:
+                    return False
+                contents = contents.encode('utf-8')
+        except (TypeError, ValueError, RuntimeError, pickle.PicklingError):
+            return False
+
+        if len(contents) > self.max_size:
+            return False
+
+        filename = self._filename(key, fmt)
+        tmp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            with os.fdopen(os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as cfd:
+                cfd.write(contents)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError):
+            return False
+
+        self.evict()
+        return True
+
+    def evict(self):
+        ''' remove the least recently used entries until the cache fits
+            in max_size
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not YeditCache.re_entry.match(name):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+            total += stat.st_size
+
+        for _, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            total -= size
+
+
+class YeditQuery(object):
+    ''' A query of a subset of JMESPath: fields, sub-expressions, indexes,
+        slices, list, object and flatten projections, filters with
+        comparisons and boolean operators, literals, multi-selects and
+        pipes.  Functions are not supported.  A query is parsed once, with
+        a Pratt parser, into a tree of tuples that search() evaluates.
+    '''
+    cache_size = 256
+    _cache = collections.OrderedDict()
+    re_token = re.compile(r"""\s*(?:
+        (?P<number>-?\d+)|
+        (?P<unquoted_identifier>[A-Za-z_][A-Za-z0-9_]*)|
+        (?P<quoted_identifier>"(?:[^"\\]|\\.)*")|
+        (?P<raw_string>'(?:[^'\\]|\\.)*')|
+        (?P<literal>`(?:[^`\\]|\\.)*`)|
+        (?P<operator>\[\?|\[\]|\|\||&&|==|!=|<=|>=|[.*\[\],:|!<>(){}@])
+    )""", re.X)
+    operators = {'.': 'dot', '*': 'star', '[': 'lbracket', ']': 'rbracket', ',': 'comma', ':': 'colon',
+                 '|': 'pipe', '!': 'not', '<': 'lt', '>': 'gt', '(': 'lparen', ')': 'rparen',
+                 '{': 'lbrace', '}': 'rbrace', '@': 'current', '[?': 'filter', '[]': 'flatten',
+                 '||': 'or', '&&': 'and', '==': 'eq', '!=': 'ne', '<=': 'lte', '>=': 'gte'}
+    binding_power = {'eof': 0, 'unquoted_identifier': 0, 'quoted_identifier': 0, 'literal': 0,
+                     'rbracket': 0, 'rparen': 0, 'comma': 0, 'rbrace': 0, 'number': 0, 'current': 0,
+                     'colon': 0, 'pipe': 1, 'or': 2, 'and': 3, 'eq': 5, 'ne': 5, 'lt': 5, 'lte': 5,
+                     'gt': 5, 'gte': 5, 'flatten': 9, 'star': 20, 'filter': 21, 'dot': 40, 'not': 45,
+                     'lbrace': 50, 'lbracket': 55, 'lparen': 60}
+    # tokens binding less than this end the right side of a projection
+    projection_stop = 10
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._tokens = YeditQuery.tokenize(expression)
+        self._pos = 0
+        self.ast = self._parse()
+        if self._current() != 'eof':
+            self._error('unexpected {0}'.format(self._current()))
+        self._tokens = None
+
+    @staticmethod
+    def compile(expression):
+        ''' return the query of expression.  Queries are kept in a bounded
+            LRU cache by expression.
+        '''
+        try:
+            query = YeditQuery._cache.pop(expression)
+        except KeyError:
+            query = YeditQuery(expression)
+            if len(YeditQuery._cache) >= YeditQuery.cache_size:
+                YeditQuery._cache.popitem(last=False)
+
+        YeditQuery._cache[expression] = query
+        return query
+
+    def search(self, data):
+        ''' return the result of the query against data '''
+        return YeditQuery.evaluate(self.ast, data)
+
+    @staticmethod
+    def tokenize(expression):
+        ''' return the (type, value) tokens of expression '''
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = YeditQuery.re_token.match(expression, pos)
+            if match is None:
+                raise YeditException('Invalid query {0!r}: unexpected character at {1}'.format(expression, pos))
+
+            kind = match.lastgroup
+            text = match.group(kind)
+            value = text
+            try:
+                if kind == 'operator':
+                    kind = YeditQuery.operators[text]
+                elif kind == 'number':
+                    value = int(text)
+                elif kind == 'quoted_identifier':
+                    value = json.loads(text)
+                elif kind == 'raw_string':
+                    kind = 'literal'
+                    value = text[1:-1].replace("\\'", "'")
+                elif kind == 'literal':
+                    value = json.loads(text[1:-1].replace('\\`', '`'))
+            except ValueError:
+                raise YeditException('Invalid query {0!r}: bad literal {1}'.format(expression, text))
+
+            tokens.append((kind, value))
+            pos = match.end()
+
+        tokens.append(('eof', None))
+        return tokens
+
+    def _current(self):
+        ''' return the type of the current token '''
+        return self._tokens[self._pos][0]
+
+    def _lookahead(self, count):
+        ''' return the type of the token count tokens ahead '''
+        return self._tokens[min(self._pos + count, len(self._tokens) - 1)][0]
+
+    def _advance(self):
+        ''' return the current token and move to the next one '''
+        token = self._tokens[self._pos]
+        self._pos = min(self._pos + 1, len(self._tokens) - 1)
+        return token
+
+    def _match(self, kind):
+        ''' move past the current token, which must be of type kind '''
+        if self._current() != kind:
+            self._error('expected {0}, found {1}'.format(kind, self._current()))
+        self._advance()
+
+    def _error(self, msg):
+        ''' raise the parse error msg '''
+        raise YeditException('Invalid query {0!r}: {1} at token {2}'.format(self.expression, msg, self._pos))
+
+    def _parse(self, binding_power=0):
+        ''' parse the expression that starts at the current token, up to an
+            operator that binds less than binding_power
+        '''
+        kind, value = self._advance()
+        left = self._nud(kind, value)
+        while binding_power < YeditQuery.binding_power[self._current()]:
+            kind, _ = self._advance()
+            left = self._led(kind, left)
+
+        return left
+
+    # pylint: disable=too-many-return-statements
+    def _nud(self, kind, value):
+        ''' parse the expression that starts with a token of type kind '''
+        power = YeditQuery.binding_power
+        if kind == 'literal':
+            return ('literal', value)
+        if kind in ['unquoted_identifier', 'quoted_identifier']:
+            return ('field', value)
+        if kind == 'current':
+            return ('current',)
+        if kind == 'star':
+            right = ('current',) if self._current() == 'rbracket' else self._projection_rhs(power['star'])
+            return ('value_projection', ('current',), right)
+        if kind == 'filter':
+            return self._led(kind, ('current',))
+        if kind == 'flatten':
+            return ('projection', ('flatten', ('current',)), self._projection_rhs(power['flatten']))
+        if kind == 'not':
+            return ('not', self._parse(power['not']))
+        if kind == 'lparen':
+            expression = self._parse()
+            self._match('rparen')
+            return expression
+        if kind == 'lbrace':
+            return self._multi_select_hash()
+        if kind == 'lbracket':
+            if self._current() in ['number', 'colon']:
+                return self._project_if_slice(('current',), self._index_expression())
+            if self._current() == 'star' and self._lookahead(1) == 'rbracket':
+                self._advance()
+                self._advance()
+                return ('projection', ('current',), self._projection_rhs(power['star']))
+            return self._multi_select_list()
+
+        return self._error('unexpected {0}'.format(kind))
+
+    # pylint: disable=too-many-return-statements
+    def _led(self, kind, left):
+        ''' parse the expression an infix token of type kind makes of left '''
+        power = YeditQuery.binding_power
+        if kind == 'dot':
+            if self._current() != 'star':
+                return ('subexpression', left, self._dot_rhs(power['dot']))
+            self._advance()
+            return ('value_projection', left, self._projection_rhs(power['dot']))
+        if kind == 'pipe':
+            return ('pipe', left, self._parse(power['pipe']))
+        if kind in ['or', 'and']:
+            return (kind, left, self._parse(power[kind]))
+        if kind in ['eq', 'ne', 'lt', 'lte', 'gt', 'gte']:
+            return ('comparator', kind, left, self._parse(power[kind]))
+        if kind == 'flatten':
+            return ('projection', ('flatten', left), self._projection_rhs(power['flatten']))
+        if kind == 'filter':
+            condition = self._parse()
+            self._match('rbracket')
+            right = ('current',) if self._current() == 'flatten' else self._projection_rhs(power['filter'])
+            return ('filter_projection', left, right, condition)
+        if kind == 'lbracket':
+            if self._current() in ['number', 'colon']:
+                return self._project_if_slice(left, self._index_expression())
+            self._match('star')
+            self._match('rbracket')
+            return ('projection', left, self._projection_rhs(power['star']))
+
+        return self._error('unexpected {0}'.format(kind))
+
+    def _projection_rhs(self, binding_power):
+        ''' parse the expression applied to each element of a projection '''
+        current = self._current()
+        if YeditQuery.binding_power[current] < YeditQuery.projection_stop:
+            return ('current',)
+        if current in ['lbracket', 'filter']:
+            return self._parse(binding_power)
+        if current == 'dot':
+            self._advance()
+            return self._dot_rhs(binding_power)
+
+        return self._error('unexpected {0}'.format(current))
+
+    def _dot_rhs(self, binding_power):
+        ''' parse the expression after a dot '''
+        current = self._current()
+        if current in ['quoted_identifier', 'unquoted_identifier', 'star']:
+            return self._parse(binding_power)
+        if current == 'lbracket':
+            self._advance()
+            return self._multi_select_list()
+        if current == 'lbrace':
+            self._advance()
+            return self._multi_select_hash()
+
+        return self._error('unexpected {0}'.format(current))
+
+    def _index_expression(self):
+        ''' parse an index or a slice, after its opening bracket '''
+        if self._current() == 'colon' or self._lookahead(1) == 'colon':
+            parts = [None, None, None]
+            part = 0
+            while self._current() != 'rbracket':
+                if self._current() == 'colon' and part < 2:
+                    part += 1
+                elif self._current() == 'number':
+                    parts[part] = self._tokens[self._pos][1]
+                else:
+                    self._error('unexpected {0} in slice'.format(self._current()))
+                self._advance()
+            self._match('rbracket')
+            if parts[2] == 0:
+                self._error('slice step cannot be 0')
+            return ('slice', parts[0], parts[1], parts[2])
+
+        _, value = self._advance()
+        self._match('rbracket')
+        return ('index', value)
+
+    def _project_if_slice(self, left, right):
+        ''' return left indexed by right, projected when right is a slice '''
+        indexed = ('index_expression', left, right)
+        if right[0] == 'slice':
+            return ('projection', indexed, self._projection_rhs(YeditQuery.binding_power['star']))
+        return indexed
+
+    def _multi_select_list(self):
+        ''' parse [a, b], after its opening bracket '''
+        expressions = []
+        while True:
+            expressions.append(self._parse())
+            if self._current() == 'rbracket':
+                break
+            self._match('comma')
+        self._match('rbracket')
+        return ('multi_select_list', expressions)
+
+    def _multi_select_hash(self):
+        ''' parse {name: a, other: b}, after its opening brace '''
+        pairs = []
+        while True:
+            kind, name = self._advance()
+            if kind not in ['quoted_identifier', 'unquoted_identifier']:
+                self._error('expected a key name, found {0}'.format(kind))
+            self._match('colon')
+            pairs.append((name, self._parse()))
+            if self._current() == 'rbrace':
+                break
+            self._match('comma')
+        self._match('rbrace')
+        return ('multi_select_hash', pairs)
+
+    @staticmethod
+    def truthy(value):
+        ''' return whether value is true for a filter: everything but null,
+            false and empty strings, lists and dicts
+        '''
+        if value is None or value is False:
+            return False
+        if isinstance(value, (str, list, dict)):
+            return len(value) > 0
+        return True
+
+    @staticmethod
+    def compare(operator, left, right):
+        ''' return the comparison of left and right.  Booleans only equal
+            booleans and only numbers are ordered.
+        '''
+        if operator in ['eq', 'ne']:
+            if isinstance(left, bool) or isinstance(right, bool):
+                equal = isinstance(left, bool) and isinstance(right, bool) and left == right
+            else:
+                equal = left == right
+            return equal if operator == 'eq' else not equal
+
+        if [side for side in (left, right) if not isinstance(side, (int, float)) or isinstance(side, bool)]:
+            return None
+        if operator == 'lt':
+            return left < right
+        if operator == 'lte':
+            return left <= right
+        if operator == 'gt':
+            return left > right
+        return left >= right
+
+    # pylint: disable=too-many-return-statements,too-many-branches
+    @staticmethod
+    def evaluate(node, value):
+        ''' return the result of the parsed query node against value '''
+        kind = node[0]
+        if kind == 'field':
+            return value.get(node[1]) if isinstance(value, dict) else None
+        if kind in ['subexpression', 'index_expression', 'pipe']:
+            return YeditQuery.evaluate(node[2], YeditQuery.evaluate(node[1], value))
+        if kind == 'current':
+            return value
+        if kind == 'literal':
+            return node[1]
+        if kind == 'index':
+            if not isinstance(value, list) or not -len(value) <= node[1] < len(value):
+                return None
+            return value[node[1]]
+        if kind == 'slice':
+            return list(value)[node[1]:node[2]:node[3]] if isinstance(value, list) else None
+
+        if kind in ['projection', 'value_projection', 'filter_projection']:
+            base = YeditQuery.evaluate(node[1], value)
+            if kind == 'value_projection':
+                base = list(base.values()) if isinstance(base, dict) else None
+            if not isinstance(base, list):
+                return None
+
+            collected = []
+            for item in base:
+                if kind == 'filter_projection' and not YeditQuery.truthy(YeditQuery.evaluate(node[3], item)):
+                    continue
+                result = YeditQuery.evaluate(node[2], item)
+                if result is not None:
+                    collected.append(result)
+            return collected
+
+        if kind == 'flatten':
+            base = YeditQuery.evaluate(node[1], value)
+            if not isinstance(base, list):
+                return None
+            merged = []
+            for item in base:
+                if isinstance(item, list):
+                    merged.extend(item)
+                else:
+                    merged.append(item)
+            return merged
+
+        if kind == 'comparator':
+            return YeditQuery.compare(node[1], YeditQuery.evaluate(node[2], value),
+                                      YeditQuery.evaluate(node[3], value))
+        if kind == 'or':
+            left = YeditQuery.evaluate(node[1], value)
+            return left if YeditQuery.truthy(left) else YeditQuery.evaluate(node[2], value)
+        if kind == 'and':
+            left = YeditQuery.evaluate(node[1], value)
+            return YeditQuery.evaluate(node[2], value) if YeditQuery.truthy(left) else left
+        if kind == 'not':
+            return not YeditQuery.truthy(YeditQuery.evaluate(node[1], value))
+
+        if value is None:
+            return None
+        if kind == 'multi_select_list':
+            return [YeditQuery.evaluate(expression, value) for expression in node[1]]
+        return collections.OrderedDict((name, YeditQuery.evaluate(expression, value))
+                                       for name, expression in node[1])
+
+
 def json_roundtrip_clean(js):
     ''' Clean-up any non-string keys from a Python object, to ensure it can be serialized as JSON '''
     cleaned_json = json.dumps(js, skipkeys=True)
     return json.loads(cleaned_json)
 
+
+def _run_path(params):
+    ''' Run the module against one file of a paths run.  This is a module
+        level function so it can be handed to worker processes.  Returns the
+        result and the files still waiting for a batch durability fsync.
+    '''
+    try:
+        rval = json_roundtrip_clean(Yedit._run_file(params))
+    except Exception as err:  # pylint: disable=broad-except
+        rval = {'failed': True, 'msg': str(err)}
+    rval['src'] = params['src']
+
+    pending_syncs, Yedit._pending_syncs = Yedit._pending_syncs, []
+    return (rval, pending_syncs)
+
 # pylint: disable=too-many-branches
 def main():
     ''' ansible oc module for secrets '''
@@ -957,14 +3986,29 @@ def main():
                        choices=['present', 'absent', 'list']),
             debug=dict(default=False, type='bool'),
             src=dict(default=None, type='str'),
+            paths=dict(default=None, type='list'),
+            document=dict(default=None, type='str'),
+            path_index=dict(default=False, type='bool'),
+            path_index_depth=dict(default=3, type='int'),
+            path_index_max_entries=dict(default=10000, type='int'),
+            journal=dict(default=False, type='bool'),
+            expected_checksum=dict(default=None, type='str'),
+            retries=dict(default=3, type='int'),
+            lock=dict(default=False, type='bool'),
+            lock_timeout=dict(default=30, type='float'),
+            workers=dict(default=None, type='int'),
             content=dict(default=None),
             content_type=dict(default='yaml', choices=['yaml', 'json']),
             key=dict(default='', type='str'),
+            query=dict(default=None, type='str'),
             value=dict(),
             value_type=dict(default='', type='str'),
             update=dict(default=False, type='bool'),
             append=dict(default=False, type='bool'),
             insert=dict(default=False, type='bool'),
+            extend=dict(default=False, type='bool'),
+            extend_unique=dict(default=False, type='bool'),
+            remove_many=dict(default=False, type='bool'),
             index=dict(default=None, type='int'),
             curr_value=dict(default=None, type='str'),
             curr_value_format=dict(default='yaml',
@@ -974,14 +4018,21 @@ def main():
             backup_ext=dict(default=".{0}".format(time.strftime("%Y%m%dT%H%M%S")), type='str'),
             separator=dict(default='.', type='str'),
             edits=dict(default=None, type='list'),
+            durability=dict(default='full', type='str',
+                            choices=['full', 'data', 'batch', 'none']),
+            preserve_format=dict(default=True, type='bool'),
+            cache_dir=dict(default=None, type='path'),
+            cache_size=dict(default=104857600, type='int'),
         ),
-        mutually_exclusive=[["curr_value", "index"], ['update', "append"]],
-        required_one_of=[["content", "src"]],
+        mutually_exclusive=[["curr_value", "index"],
+                            ['update', 'append', 'insert', 'extend', 'extend_unique', 'remove_many'],
+                            ['src', 'paths']],
+        required_one_of=[["content", "src", "paths"]],
     )
 
     # Verify we recieved either a valid key or edits with valid keys when receiving a src file.
     # A valid key being not None or not ''.
-    if module.params['src'] is not None:
+    if module.params['src'] is not None or module.params['paths']:
         key_error = False
         edit_error = False
 
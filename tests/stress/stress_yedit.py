@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+'''
+ Load test for many yedit writers on one file.
+
+ Spawns writer processes that run Yedit.run_ansible against the same file
+ with a mix of put, append and delete edits, then checks that the final
+ file holds every edit that reported success.  Prints a json report and
+ exits non-zero when an update was lost or an edit failed.
+
+   ./stress_yedit.py --writers 8 --ops 100 --lock
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# place yedit in our path
+yedit_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../library')  # noqa: E501
+sys.path.insert(0, yedit_path)
+
+from yedit import Yedit  # noqa: E402
+
+
+def module_params(args, filename, **params):
+    '''return the module parameters of one edit'''
+    rval = {'src': filename, 'state': 'present', 'key': '', 'value': None, 'value_type': '',
+            'update': False, 'append': False, 'insert': False, 'index': None,
+            'curr_value': None, 'curr_value_format': 'yaml', 'backup': False, 'backup_ext': '',
+            'separator': '.', 'edits': None, 'content': None, 'content_type': 'yaml',
+            'durability': args.durability, 'retries': args.retries,
+            'lock': args.lock, 'lock_timeout': args.lock_timeout}
+    rval.update(params)
+    return rval
+
+
+def writer(args, filename, number, start):
+    '''run the edits of one writer.  Returns its timings and the state its
+       successful edits should have left in the file.
+    '''
+    rand = random.Random(args.seed + number)
+    weights = [('put', args.put), ('append', args.append), ('delete', args.delete)]
+    puts = {}
+    appends = []
+    latencies = []
+    lock_waits = []
+    conflicts = 0
+    failures = []
+
+    start.wait()
+    for ind in range(args.ops):
+        action = rand.choice([name for name, weight in weights for _ in range(weight)])
+        if action == 'delete' and not [key for key, value in puts.items() if value is not None]:
+            action = 'put'
+
+        if action == 'put':
+            key = 'writers.w{0}.k{1}'.format(number, rand.randrange(args.keys))
+            value = '{0}-{1}'.format(number, ind)
+            params = module_params(args, filename, key=key, value=value)
+        elif action == 'append':
+            value = 'w{0}-{1}'.format(number, ind)
+            params = module_params(args, filename, key='log', value=value, append=True)
+        else:
+            key = rand.choice(sorted(key for key, value in puts.items() if value is not None))
+            params = module_params(args, filename, key=key, state='absent')
+
+        began = time.time()
+        try:
+            result = Yedit.run_ansible(params)
+        except Exception as err:  # pylint: disable=broad-except
+            result = {'failed': True, 'msg': str(err)}
+        latencies.append(time.time() - began)
+        lock_waits.append(result.get('lock', {}).get('wait', 0.0))
+        conflicts += result.get('conflicts', 0)
+
+        if result.get('failed'):
+            failures.append(result.get('msg'))
+        elif action == 'put':
+            puts[key] = value
+        elif action == 'append':
+            appends.append(value)
+        else:
+            puts[key] = None
+
+    return {'puts': puts, 'appends': appends, 'latencies': latencies,
+            'lock_waits': lock_waits, 'conflicts': conflicts, 'failures': failures}
+
+
+def run_writer(args, filename, number, start, queue):
+    '''run a writer in its own process and queue its result'''
+    queue.put((number, writer(args, filename, number, start)))
+
+
+def percentiles(values):
+    '''return the p50, p99 and max of values in milliseconds'''
+    values = sorted(values)
+    if not values:
+        return {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    def pick(fraction):
+        '''return the value at fraction of the sorted values'''
+        return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+
+    return {'p50': pick(0.5), 'p99': pick(0.99), 'max': round(values[-1] * 1000, 3)}
+
+
+def verify(filename, results):
+    '''return the edits that reported success but are not in the file'''
+    data = Yedit(filename).yaml_dict
+    lost = []
+    log = data.get('log') or []
+    for number, result in enumerate(results):
+        for key, value in sorted(result['puts'].items()):
+            if Yedit.get_entry(data, key) != value:
+                lost.append({'writer': number, 'key': key, 'expected': value,
+                             'found': Yedit.get_entry(data, key)})
+        for value in result['appends']:
+            if log.count(value) != 1:
+                lost.append({'writer': number, 'key': 'log', 'expected': value, 'found': log.count(value)})
+
+    return lost
+
+
+def main():
+    '''run the load test and print its report'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4, help='number of writer processes')
+    parser.add_argument('--ops', type=int, default=50, help='edits per writer')
+    parser.add_argument('--keys', type=int, default=10, help='keys each writer puts to')
+    parser.add_argument('--put', type=int, default=6, help='weight of put edits')
+    parser.add_argument('--append', type=int, default=3, help='weight of append edits')
+    parser.add_argument('--delete', type=int, default=1, help='weight of delete edits')
+    parser.add_argument('--lock', action='store_true', help='hold the lock of the file for each edit')
+    parser.add_argument('--lock-timeout', type=float, default=60, help='seconds to wait for the lock')
+    parser.add_argument('--retries', type=int, default=Yedit.conflict_retries,
+                        help='reloads when another writer replaced the file')
+    parser.add_argument('--durability', default='none', choices=Yedit.durability_modes)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the edited file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='yedit_stress_')
+    filename = os.path.join(workdir, 'stress.yml')
+    Yedit(filename, content={'writers': {}, 'log': []}).write()
+
+    start = multiprocessing.Event()
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_writer, args=(args, filename, number, start, queue))
+                 for number in range(args.writers)]
+    for process in processes:
+        process.start()
+    began = time.time()
+    start.set()
+    results = dict(queue.get() for _ in processes)
+    elapsed = time.time() - began
+    for process in processes:
+        process.join()
+    results = [results[number] for number in range(args.writers)]
+
+    lost = verify(filename, results)
+    operations = args.writers * args.ops
+    failures = [msg for result in results for msg in result['failures']]
+    report = {
+        'config': vars(args),
+        'operations': operations,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(operations / elapsed, 3) if elapsed else None,
+        'latency_ms': percentiles([value for result in results for value in result['latencies']]),
+        'lock_wait_ms': percentiles([value for result in results for value in result['lock_waits']]),
+        'conflicts': sum(result['conflicts'] for result in results),
+        'failed': len(failures),
+        'failures': sorted(set(failures))[:10],
+        'lost_updates': len(lost),
+        'lost': lost[:10],
+        'ok': not lost and not failures,
+    }
+    if args.keep:
+        report['file'] = filename
+    else:
+        shutil.rmtree(workdir)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,8 +2,16 @@
  Unit tests for yedit
 '''
 
+import copy
+import datetime
+import fcntl
+import glob
+import hashlib
+import json
 import os
+import shutil
 import sys
+import tracemalloc
 import unittest
 import mock
 
@@ -16,7 +24,7 @@ import mock
 yedit_path = os.path.join(os.path.realpath('.'), '../../library')  # noqa: E501
 sys.path.insert(0, yedit_path)
 
-from yedit import Yedit, YeditException  # noqa: E402
+from yedit import Yedit, YeditCache, YeditException, YeditIndex, YeditLock, YeditQuery, YeditTempFile  # noqa: E402
 
 # pylint: disable=too-many-public-methods
 # Silly pylint, moar tests!
@@ -43,6 +51,29 @@ class YeditTest(unittest.TestCase):
         yed = Yedit('yedit_test.yml')
         self.assertEqual(yed.yaml_dict, self.data)
 
+    def test_load_reuses_parsed_file(self):
+        ''' Testing a second load does not read an unchanged file again '''
+        yed = Yedit('yedit_test.yml')
+        with mock.patch('yedit.Yedit.read') as mock_read:
+            yed.load()
+        self.assertFalse(mock_read.called)
+        self.assertEqual(yed.yaml_dict, self.data)
+
+    def test_load_rereads_changed_file(self):
+        ''' Testing load parses the file again once it changed '''
+        yed = Yedit('yedit_test.yml')
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('changed: true\n')
+        yed.load()
+        self.assertEqual(yed.yaml_dict, {'changed': True})
+
+    def test_load_after_put_rereads_file(self):
+        ''' Testing load discards in-memory edits like before '''
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', 'modified')
+        yed.load()
+        self.assertEqual(yed.get('a'), 'a')
+
     def test_write(self):
         ''' Testing a simple write '''
         yed = Yedit('yedit_test.yml')
@@ -51,6 +82,149 @@ class YeditTest(unittest.TestCase):
         self.assertTrue('key1' in yed.yaml_dict)
         self.assertEqual(yed.yaml_dict['key1'], 1)
 
+    def test_write_identical_is_noop(self):
+        ''' Testing writing unchanged content does not replace the file '''
+        inode = os.stat('yedit_test.yml').st_ino
+        yed = Yedit('yedit_test.yml', backup=True, backup_ext='.bak')
+        changed, _ = yed.write()
+        self.assertFalse(changed)
+        self.assertEqual(os.stat('yedit_test.yml').st_ino, inode)
+        self.assertFalse(os.path.exists('yedit_test.yml.bak'))
+        self.assertEqual(glob.glob('yedit_test.yml.yedit*'), [])
+
+        # the output is compared with the file before any temp file exists
+        with mock.patch.object(YeditTempFile, '_create') as mock_create:
+            self.assertFalse(Yedit('yedit_test.yml').write()[0])
+        self.assertFalse(mock_create.called)
+
+    def test_write_failure_removes_temp_file(self):
+        ''' Testing a serializer error leaves the file and no temp file '''
+        with open('yedit_test.yml') as yfd:
+            contents = yfd.read()
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', object())
+        with self.assertRaises(Exception):
+            yed.write()
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), contents)
+        self.assertEqual(glob.glob('yedit_test.yml.yedit*'), [])
+
+    def test_write_streams_to_file(self):
+        ''' Testing write does not build the serialized document in memory '''
+        data = [{'name': 'item-{0}'.format(i), 'value': i} for i in range(20000)]
+        size = len(json.dumps(data, indent=4, sort_keys=True))
+        yed = Yedit('yedit_test.json', content_type='json')
+        yed.yaml_dict = data
+        tracemalloc.start()
+        try:
+            yed.write()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            os.unlink('yedit_test.json')
+        self.assertLess(peak, size // 4)
+
+    def test_write_changed_content(self):
+        ''' Testing writing changed content reports a change '''
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', 'changed')
+        changed, _ = yed.write()
+        self.assertTrue(changed)
+        self.assertFalse(yed.write()[0])
+
+    @mock.patch('yedit.os.fsync')
+    def test_write_durability_modes(self, mock_fsync):
+        ''' Testing the number of fsyncs for each durability mode '''
+        for durability, fsyncs in [('full', 2), ('data', 1), ('none', 0)]:
+            mock_fsync.reset_mock()
+            yed = Yedit('yedit_test.yml', durability=durability)
+            yed.put('a', durability)
+            yed.write()
+            self.assertEqual(mock_fsync.call_count, fsyncs)
+
+    @mock.patch('yedit.os.fsync')
+    def test_write_durability_batch(self, mock_fsync):
+        ''' Testing batch durability syncs the directory once at the end '''
+        filenames = ['yedit_batch_{0}.yml'.format(i) for i in range(3)]
+        try:
+            for filename in filenames:
+                yed = Yedit(filename, content={'a': 1}, durability='batch')
+                yed.write()
+            self.assertEqual(mock_fsync.call_count, 0)
+            Yedit.sync_pending()
+            self.assertEqual(mock_fsync.call_count, len(filenames) + 1)
+        finally:
+            for filename in filenames:
+                os.unlink(filename)
+
+    def test_fast_engine(self):
+        ''' Testing loading and writing without preserving format '''
+        yed = Yedit('yedit_test.yml', preserve_format=False)
+        self.assertEqual(type(yed.yaml_dict), dict)
+        self.assertEqual(yed.yaml_dict, self.data)
+        yed.put('b.c.e', 'fast')
+        self.assertTrue(yed.write()[0])
+        self.assertNotEqual(yed.engine, 'round_trip')
+        self.assertEqual(Yedit('yedit_test.yml').get('b.c.e'), 'fast')
+
+    def test_yaml_file_with_json_contents(self):
+        ''' Testing a json file loaded as yaml is written back as json '''
+        contents = '{\n  "b": 1,\n  "a": [\n    "x"\n  ]\n}\n'
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write(contents)
+        yed = Yedit('yedit_test.yml')
+        self.assertEqual(yed.engine, 'json')
+        self.assertFalse(yed.write()[0])
+        yed.put('a[1]', 'y')
+        self.assertTrue(yed.write()[0])
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), contents.replace('"x"\n', '"x",\n    "y"\n'))
+
+    def test_yaml_file_with_unusual_json_style(self):
+        ''' Testing json contents whose style cannot be reproduced are left to yaml '''
+        contents = '{\n  "a": {\n      "b": 1\n  },\n  "c": [1,2]\n}\n'
+        self.assertEqual(Yedit.load_json_style(contents), (None, None))
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write(contents)
+        yed = Yedit('yedit_test.yml')
+        self.assertNotEqual(yed.engine, 'json')
+        self.assertEqual(yed.get('a.b'), 1)
+
+    def test_yaml_file_with_json_contents_gets_yaml_values(self):
+        ''' Testing json contents given a value json cannot hold are written as yaml '''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('{"a": 1}')
+        yed = Yedit('yedit_test.yml')
+        self.assertEqual(yed.engine, 'json')
+        yed.put('b', Yedit.parse_value('2020-01-01', 'yaml'))
+        self.assertTrue(yed.write()[0])
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), 'a: 1\nb: 2020-01-01\n')
+        self.assertEqual(glob.glob('yedit_test.yml.yedit*'), [])
+
+    def test_multi_document_select_by_predicate(self):
+        ''' Testing editing one document of a multi-document file '''
+        docs = ['# bundle\n---\nkind: Deployment\nmetadata:\n  name: foo\nspec:\n  replicas: 1\n',
+                '---\nkind: Service   # untouched\nmetadata: {name: foo}\n',
+                '--- # last\nkind: Deployment\nmetadata:\n  name: bar\nspec:\n  replicas: 1\n']
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write(''.join(docs))
+        yed = Yedit('yedit_test.yml', document='kind=Deployment,metadata.name=bar')
+        self.assertEqual(yed.get('metadata.name'), 'bar')
+        yed.put('spec.replicas', 3)
+        yed.write()
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), docs[0] + docs[1] + docs[2].replace('replicas: 1', 'replicas: 3'))
+
+    def test_multi_document_select_by_index(self):
+        ''' Testing selecting a document by index '''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: 1\n---\nb: 2\n---\nc: 3\n')
+        self.assertEqual(Yedit('yedit_test.yml', document='1').yaml_dict, {'b': 2})
+        self.assertEqual(Yedit('yedit_test.yml', document=-1).yaml_dict, {'c': 3})
+        with self.assertRaises(YeditException):
+            Yedit('yedit_test.yml', document='kind=Missing')
+
     def test_write_x_y_z(self):
         '''Testing a write of multilayer key'''
         yed = Yedit('yedit_test.yml')
@@ -278,6 +452,33 @@ class YeditTest(unittest.TestCase):
         with self.assertRaises(YeditException):
             yed.put('new.stuff.here[0]', 'item')
 
+    def test_failed_put_leaves_document_untouched(self):
+        '''test a put that fails part way through the key path is rolled back'''
+        yed = Yedit(content={'a': {'b': 12}})
+        with self.assertRaises(YeditException):
+            yed.put('new.stuff[0].here', 'value')
+        self.assertEqual(yed.yaml_dict, {'a': {'b': 12}})
+
+    def test_process_edits_rolls_back_batch(self):
+        '''test a failing edit rolls back every edit of the batch'''
+        yed = Yedit(content={'a': {'b': 12}, 'c': [1, 2]})
+        edits = [{'key': 'a.b', 'value': 13},
+                 {'key': 'c', 'value': 3, 'action': 'append'},
+                 {'key': 'a.d', 'value': 'x'},
+                 {'key': 'new.stuff[0].here', 'value': 'value'}]
+        with self.assertRaises(YeditException):
+            Yedit.process_edits(edits, yed)
+        self.assertEqual(yed.yaml_dict, {'a': {'b': 12}, 'c': [1, 2]})
+
+    def test_process_edits_commits_batch(self):
+        '''test a successful batch keeps every edit'''
+        yed = Yedit(content={'a': {'b': 12}, 'c': [1, 2]})
+        edits = [{'key': 'a.b', 'value': 13},
+                 {'key': 'c', 'value': 3, 'action': 'append'}]
+        results = Yedit.process_edits(edits, yed)
+        self.assertTrue(results['changed'])
+        self.assertEqual(yed.yaml_dict, {'a': {'b': 13}, 'c': [1, 2, 3]})
+
     def test_empty_key_with_int_value(self):
         '''test editing top level with not list or dict'''
         yed = Yedit(content={'a': {'b': 12}})
@@ -309,6 +510,19 @@ class YeditTest(unittest.TestCase):
         yed.put("[1]", [{"next": "something"}])
         self.assertTrue(yed.yaml_dict, [{'a': {'b': [{'c': 3}]}}, {"next": "something"}])
 
+    def test_compile_key(self):
+        '''test compiling a key into typed path segments'''
+        self.assertEqual(Yedit.compile_key('a.b[0].c[-1]'), ('a', 'b', 0, 'c', -1))
+        self.assertEqual(Yedit.compile_key('a.b:c', sep=':'), ('a.b', 'c'))
+        self.assertEqual(Yedit.compile_key(''), ())
+        self.assertIsNone(Yedit.compile_key('[x]'))
+
+    def test_compile_key_cached(self):
+        '''test compiled keys are cached per separator'''
+        path = Yedit.compile_key('x.y.z')
+        self.assertIs(Yedit.compile_key('x.y.z'), path)
+        self.assertIsNot(Yedit.compile_key('x.y.z', sep=':'), path)
+
     def test_parse_value_string_true(self):
         '''test parse_value'''
         results = Yedit.parse_value('true', 'str')
@@ -372,6 +586,744 @@ class YeditTest(unittest.TestCase):
 
         self.assertTrue(results['changed'])
 
+    def test_run_ansible_paths(self):
+        '''test applying edits to many files in parallel'''
+        filenames = ['yedit_paths_{0}.yml'.format(i) for i in range(3)]
+        for filename in filenames:
+            Yedit(filename, content={'a': {'b': 1}}).write()
+
+        params = {
+            'src': None,
+            'paths': ['yedit_paths_*.yml'],
+            'workers': 2,
+            'backup': False,
+            'backup_ext': '',
+            'separator': '.',
+            'state': 'present',
+            'edits': [{'key': 'a.b', 'value': 2}],
+            'value': None,
+            'key': None,
+            'content': None,
+            'content_type': 'yaml',
+        }
+
+        try:
+            results = Yedit.run_ansible(params)
+            self.assertTrue(results['changed'])
+            self.assertEqual(results['changed_count'], len(filenames))
+            self.assertEqual([rval['src'] for rval in results['results']], filenames)
+            for filename in filenames:
+                self.assertEqual(Yedit(filename).get('a.b'), 2)
+
+            results = Yedit.run_ansible(params)
+            self.assertFalse(results['changed'])
+            self.assertEqual(results['changed_count'], 0)
+
+            params['paths'] = ['yedit_paths_*.yml', 'yedit_typo_*.yml']
+            results = Yedit.run_ansible(params)
+            self.assertTrue(results['failed'])
+            self.assertIn('yedit_typo_*.yml', results['msg'])
+        finally:
+            for filename in filenames:
+                os.unlink(filename)
+
+    def test_stream_get(self):
+        '''test looking up keys from the parser events'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: {x: 1}\nb:\n  c:\n  - skip: [1, 2]\n  - d: {e: yes}\n  f: *missing\n')
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'b.c[1].d'), (True, {'e': 'yes'}))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'b.c[2]'), (True, None))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'a.y'), (True, None))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'a.x.y'), (True, None))
+
+    def test_stream_get_needs_full_load(self):
+        '''test the cases the event walk hands back to a full load'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('base: &base {x: 1}\nref: *base\nmerged:\n  <<: *base\nnested:\n  v: *base\n1: int\n')
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'base.x'), (True, 1))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'ref.x'), (False, None))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'merged.x'), (False, None))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'nested'), (False, None))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', '1'), (False, None))
+        self.assertEqual(Yedit.stream_get('yedit_test.yml', 'base[-1]'), (False, None))
+
+    def test_run_ansible_list_streams_key(self):
+        '''test state=list with a key does not load the whole file'''
+        params = {
+            'src': 'yedit_test.yml',
+            'backup': False,
+            'backup_ext': '',
+            'separator': '.',
+            'state': 'list',
+            'edits': [],
+            'value': None,
+            'key': 'b.c.d[0].e',
+            'content': None,
+            'content_type': 'yaml',
+        }
+
+        with mock.patch('yedit.Yedit.load') as mock_load:
+            results = Yedit.run_ansible(params)
+        self.assertFalse(mock_load.called)
+        self.assertEqual(results['result'], 'x')
+        self.assertEqual(results['engine'], 'stream')
+
+    def test_index_lookup(self):
+        '''test looking up keys through the sidecar index'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write(u'# header\nå: ö\nlist:\n- name: a\n  deep:\n    x: [1, 2]\n- b\nm: {k: v}\n')
+        try:
+            index = YeditIndex('yedit_test.yml', depth=2)
+            self.assertEqual(index.get('list[0].deep.x'), (True, [1, 2]))
+            self.assertTrue(index.rebuilt)
+            self.assertEqual(index.get('m'), (True, {'k': 'v'}))
+            self.assertEqual(index.get('list[1]'), (True, 'b'))
+            self.assertEqual(index.get('missing.key'), (True, None))
+            self.assertEqual(index.stats()['hits'], 4)
+
+            index = YeditIndex('yedit_test.yml', depth=2)
+            self.assertEqual(index.get('m.k'), (True, 'v'))
+            self.assertFalse(index.rebuilt)
+
+            yed = Yedit('yedit_test.yml')
+            yed.put('m.k', 'changed')
+            yed.write()
+            index = YeditIndex('yedit_test.yml', depth=2)
+            self.assertEqual(index.get('m.k'), (True, 'changed'))
+            self.assertTrue(index.rebuilt)
+        finally:
+            os.unlink('yedit_test.yml.yedit_index')
+
+    def test_index_incomplete_misses(self):
+        '''test the index hands lookups it cannot answer back'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('base: &b {x: 1}\nmerged:\n  <<: *b\n')
+        try:
+            index = YeditIndex('yedit_test.yml')
+            self.assertEqual(index.get('merged.x'), (False, None))
+            self.assertEqual(index.get('base.x'), (True, 1))
+            self.assertEqual(index.stats()['misses'], 1)
+        finally:
+            os.unlink('yedit_test.yml.yedit_index')
+
+    def test_index_cut_short_walks_fragment(self):
+        '''test a lookup past a truncated index does not build the whole fragment'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('items:\n' + ''.join('- name: n{0}\n  v: {0}\n'.format(i) for i in range(200)))
+        try:
+            index = YeditIndex('yedit_test.yml', max_entries=20)
+            with mock.patch.object(Yedit, 'load_text', wraps=Yedit.load_text) as mock_load_text:
+                self.assertEqual(index.get('items[150].name'), (True, 'n150'))
+                self.assertEqual(index.get('items[150]'), (True, {'name': 'n150', 'v': 150}))
+                self.assertEqual(index.get('items[300].name'), (True, None))
+            self.assertEqual(index.stats()['entries'], 20)
+            self.assertLess(max(len(call[0][0]) for call in mock_load_text.call_args_list), 100)
+        finally:
+            os.unlink('yedit_test.yml.yedit_index')
+
+    def test_run_ansible_list_path_index(self):
+        '''test state=list answered from the path index'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a:\n  b: [1, 2]\nc: d\n')
+        params = {'src': 'yedit_test.yml', 'state': 'list', 'key': 'a.b', 'content': None,
+                  'content_type': 'yaml', 'separator': '.', 'path_index': True}
+        try:
+            results = Yedit.run_ansible(params)
+            self.assertEqual(results['result'], [1, 2])
+            self.assertEqual(results['engine'], 'index')
+            self.assertEqual(results['path_index']['hits'], 1)
+        finally:
+            os.unlink('yedit_test.yml.yedit_index')
+
+        params.update({'src': 'yedit_missing.yml', 'backup': False, 'backup_ext': ''})
+        results = Yedit.run_ansible(params)
+        self.assertIsNone(results['result'])
+        self.assertFalse(os.path.exists('yedit_missing.yml.yedit_index'))
+
+    def test_write_patches_scalars(self):
+        '''test changed scalars are patched into the original text'''
+        contents = ('# comment\na:   1   # keep\nb: [x, "y"]\nc:\n    d: \'it\'\'s\'\n'
+                    'e:\n-   f: 2.50\n')
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write(contents)
+
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', 2)
+        yed.put('b[1]', 'z,')
+        yed.put('c.d', "o'k")
+        yed.put('e[0].f', 3.5)
+        yed.write()
+        self.assertEqual(yed.engine, 'patch')
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(),
+                             '# comment\na:   2   # keep\nb: [x, "z,"]\nc:\n    d: \'o\'\'k\'\n'
+                             'e:\n-   f: 3.5\n')
+
+    def test_write_patch_falls_back(self):
+        '''test structural changes dump the whole document'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: 1\nb: |\n  text\n')
+
+        yed = Yedit('yedit_test.yml')
+        yed.put('b', 'other')
+        yed.write()
+        self.assertEqual(yed.engine, 'round_trip')
+        self.assertEqual(Yedit('yedit_test.yml').get('b'), 'other')
+
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', 2)
+        yed.put('c', 3)
+        yed.write()
+        self.assertEqual(yed.engine, 'round_trip')
+        self.assertEqual(Yedit('yedit_test.yml').yaml_dict, {'a': 2, 'b': 'other', 'c': 3})
+
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('{a: 1, b: 2}\n')
+
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', 3)
+        yed.write()
+        self.assertEqual(yed.engine, 'round_trip')
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), 'a: 3\nb: 2\n')
+
+    def test_append_in_place(self):
+        '''test appending to the list that ends the file without loading it'''
+        contents = 'a: 1\nentries:\n' + ''.join('  - name: item{0}\n    n: {0}\n'.format(i) for i in range(50))
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write(contents + '# tail')
+
+        with mock.patch.object(Yedit, 'chunk_size', 64):
+            self.assertTrue(Yedit.append_in_place('yedit_test.yml', 'entries', {'name': 'new', 'l': [1]}))
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), contents + '# tail\n  - name: new\n    l:\n    - 1\n')
+        self.assertEqual(Yedit('yedit_test.yml').get('entries[50]'), {'name': 'new', 'l': [1]})
+
+        # appending again reuses the scan while the file is unchanged
+        with mock.patch.object(Yedit, '_find_list_end') as mock_find:
+            self.assertTrue(Yedit.append_in_place('yedit_test.yml', 'entries', 'x'))
+            self.assertTrue(Yedit.append_in_place('yedit_test.yml', 'entries', 'y'))
+        self.assertFalse(mock_find.called)
+        self.assertEqual(Yedit('yedit_test.yml').get('entries')[-3:], [{'name': 'new', 'l': [1]}, 'x', 'y'])
+
+        for contents in ['entries:\n- x\nb: 1\n', 'entries: [x]\n', 'a:\n  entries:\n  - x\n', '---\n- x\n---\n- y\n',
+                         'a: 1\n---\nentries:\n- x\n', 'a: 1\n...\nentries:\n- x\n']:
+            with open('yedit_test.yml', 'w') as yfd:
+                yfd.write(contents)
+            with mock.patch.object(Yedit, 'chunk_size', 4):
+                self.assertFalse(Yedit.append_in_place('yedit_test.yml', 'entries', 'y'))
+            with open('yedit_test.yml') as yfd:
+                self.assertEqual(yfd.read(), contents)
+
+    def test_append_in_place_lock_timeout(self):
+        '''test appending falls back when another writer holds the file'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('entries:\n- x\n')
+        fd = os.open('yedit_test.yml', os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with mock.patch.object(YeditLock, 'default_timeout', 0.05):
+                self.assertFalse(Yedit.append_in_place('yedit_test.yml', 'entries', 'y'))
+        finally:
+            os.close(fd)
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), 'entries:\n- x\n')
+
+    @mock.patch('yedit.Yedit.load')
+    def test_run_ansible_append_in_place(self, mock_load):
+        '''test state=present with append does not load a file ending in the list'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('---\n- a\n')
+        params = {'src': 'yedit_test.yml', 'state': 'present', 'key': '', 'value': 'b',
+                  'value_type': '', 'append': True, 'backup': False, 'content': None,
+                  'content_type': 'yaml', 'separator': '.'}
+
+        results = Yedit.run_ansible(params)
+        self.assertTrue(results['changed'])
+        self.assertEqual(results['engine'], 'append')
+        self.assertFalse(mock_load.called)
+        with open('yedit_test.yml') as yfd:
+            self.assertEqual(yfd.read(), '---\n- a\n- b\n')
+
+    def test_parse_cache(self):
+        '''test loads are served from the parse cache'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('# comment\na: [1, 2]\nb: {c: d}\n')
+        try:
+            for preserve_format in [True, False]:
+                yed = Yedit('yedit_test.yml', cache_dir='yedit_cache', preserve_format=preserve_format)
+                self.assertEqual(yed.cache.stats(), {'hits': 0, 'misses': 1})
+                yed = Yedit('yedit_test.yml', cache_dir='yedit_cache', preserve_format=preserve_format)
+                self.assertEqual(yed.cache.stats(), {'hits': 1, 'misses': 0})
+                self.assertEqual(yed.yaml_dict, {'a': [1, 2], 'b': {'c': 'd'}})
+
+            yed.put('a[0]', 3)
+            yed.write()
+            yed = Yedit('yedit_test.yml', cache_dir='yedit_cache')
+            self.assertEqual(yed.cache.stats(), {'hits': 0, 'misses': 1})
+            self.assertEqual(yed.get('a'), [3, 2])
+        finally:
+            shutil.rmtree('yedit_cache')
+
+    def test_parse_cache_eviction(self):
+        '''test the least recently used entries are evicted'''
+        cache = YeditCache('yedit_cache', max_size=200)
+        keys = [YeditCache.key('json', str(i)) for i in range(3)]
+        try:
+            for ind, key in enumerate(keys):
+                self.assertTrue(cache.put(key, 'json', {'value': 'x' * 50}))
+                os.utime(os.path.join('yedit_cache', key + '.json'), (ind, ind))
+            self.assertFalse(cache.put(keys[0], 'json', {1: 'integer keys'}))
+            cache.get(keys[0], 'json')
+            cache.put(YeditCache.key('json', 'new'), 'json', {'value': 'x' * 50})
+            self.assertEqual([cache.get(key, 'json')[0] for key in keys], [True, False, True])
+        finally:
+            shutil.rmtree('yedit_cache')
+
+    def test_value_hash(self):
+        '''test digests agree with equality'''
+        self.assertEqual(Yedit.value_hash({'a': [1, True, 2.0], 'b': None}),
+                         Yedit.value_hash({'b': None, 'a': [1.0, 1, 2]}))
+        self.assertNotEqual(Yedit.value_hash({'a': [1, 2]}), Yedit.value_hash({'a': [2, 1]}))
+        self.assertNotEqual(Yedit.value_hash(['1']), Yedit.value_hash([1]))
+        self.assertNotEqual(Yedit.value_hash({'a': {}}), Yedit.value_hash({'a': []}))
+
+        stamps = Yedit(content='a: 2020-01-02T03:04:05+02:00\nb: 2020-01-02\nc: [2020-01-02T03:04:05+02:00]\n')
+        self.assertEqual(Yedit.value_hash(stamps.get('a')), Yedit.value_hash(datetime.datetime(2020, 1, 2, 1, 4, 5)))
+        self.assertEqual(Yedit.value_hash(stamps.get('b')), Yedit.value_hash(datetime.date(2020, 1, 2)))
+        self.assertNotEqual(Yedit.value_hash(stamps.get('b')), Yedit.value_hash(datetime.datetime(2020, 1, 2)))
+        self.assertFalse(stamps.extend_unique('c', [datetime.datetime(2020, 1, 2, 1, 4, 5)])[0])
+
+    def test_tree_hash_follows_edits(self):
+        '''test cached digests are invalidated along edited paths and aliases'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a:\n  inner: &x {k: 1}\nb:\n  wrap: *x\nc: [1, 2]\n')
+
+        yed = Yedit('yedit_test.yml')
+        self.assertFalse(yed.put('b', {'wrap': {'k': 1}})[0])
+        yed.put('a.inner.k', 2)
+        self.assertEqual(yed.tree_hash(yed.get('b')), Yedit.value_hash({'wrap': {'k': 2}}))
+        self.assertEqual(yed.tree_hash(yed.yaml_dict), Yedit.value_hash(copy.deepcopy(yed.yaml_dict)))
+
+        yed.put('c[0]', 5)
+        yed.put('c[0]', 1)
+        yed.put('d.e', 'f')
+        self.assertEqual(yed.changed_paths(), ['d.e', 'a.inner.k'])
+        yed.delete('a')
+        self.assertEqual(yed.changed_paths(), ['a', 'd.e'])
+
+    def test_changed_paths_are_compared_lazily(self):
+        '''test edits do not digest the values they replace'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a:\n' + ''.join('- {{n: {0}}}\n'.format(i) for i in range(1000)) + 'b: {c: 1}\n')
+
+        yed = Yedit('yedit_test.yml')
+        yed.append('a', {'n': 1000})
+        yed.put('b.c', 2)
+        yed.put('a[0].n', 5)
+        self.assertEqual(yed._hashes, {})
+        self.assertEqual(yed.changed_paths(), ['a', 'b.c'])
+
+        yed.pop('a', {'n': 1000})
+        yed.put('a[0].n', 0)
+        yed.put('b.c', 1)
+        self.assertEqual(yed.changed_paths(), [])
+
+    def test_changed_paths_reuse_digests(self):
+        '''test edits are compared through digests, rehashing edited containers only'''
+        yed = Yedit(content='a:\n' + ''.join('- {{n: {0}}}\n'.format(i) for i in range(100)) + 'b: []\n')
+        self.assertFalse(yed.put('a', [{'n': i} for i in range(100)])[0])
+        self.assertIn(id(yed.get('a')), yed._hashes)
+
+        yed.append('a', {'n': 100})
+        yed.put('a[3].n', 0)
+        yed.put('a[3].n', 3)
+        yed.append('b', 1)
+        self.assertNotIn(id(yed.get('a')), yed._hashes)
+        self.assertIn(id(yed.get('a[4]')), yed._hashes)
+        with mock.patch('yedit.hashlib.sha1', side_effect=hashlib.sha1) as mock_sha1:
+            self.assertEqual(yed.changed_paths(), ['a', 'b'])
+        self.assertLess(mock_sha1.call_count, 20)
+
+        yed.pop('a', {'n': 100})
+        yed.pop('b', 1)
+        self.assertEqual(yed.changed_paths(), [])
+
+    def test_rollback_nested_in_round_trip_file(self):
+        '''test nested edits of a loaded file are rolled back'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a:\n  b: [1, 2]\n')
+
+        yed = Yedit('yedit_test.yml')
+        yed.begin()
+        yed.append('a.b', 3)
+        yed.put('a.c', 'd')
+        yed.rollback()
+        self.assertEqual(yed.yaml_dict, {'a': {'b': [1, 2]}})
+
+        yed.begin()
+        yed.put('a.b', {'c': 2, 'd': 3})
+        yed.put('a.b.c', 9)
+        yed.rollback()
+        self.assertEqual(yed.yaml_dict, {'a': {'b': [1, 2]}})
+
+    def test_run_ansible_journal(self):
+        '''test edits already applied to the file are skipped without parsing'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: 1\n')
+        params = {'src': 'yedit_test.yml', 'state': 'present', 'key': 'a', 'value': 2, 'value_type': '',
+                  'update': False, 'append': False, 'insert': False, 'backup': False, 'backup_ext': '',
+                  'content': None, 'content_type': 'yaml', 'separator': '.', 'edits': None,
+                  'journal': True}
+        try:
+            results = Yedit.run_ansible(params)
+            self.assertTrue(results['changed'])
+            self.assertEqual(results['journal'], 'miss')
+
+            with mock.patch('yedit.Yedit.load') as mock_load:
+                results = Yedit.run_ansible(params)
+                self.assertFalse(mock_load.called)
+            self.assertEqual(results, {'changed': False, 'result': [], 'state': 'present', 'journal': 'hit',
+                                       'checksum': Yedit.checksum('yedit_test.yml')})
+
+            with open('yedit_test.yml', 'w') as yfd:
+                yfd.write('a: 3\n')
+            results = Yedit.run_ansible(params)
+            self.assertTrue(results['changed'])
+            self.assertEqual(results['journal'], 'miss')
+
+            # another writer replacing the file right after the run
+            write = Yedit._write
+
+            def racing_write(*args, **kwargs):
+                '''replace the file once it is written'''
+                changed = write(*args, **kwargs)
+                with open('yedit_test.yml', 'w') as yfd:
+                    yfd.write('a: 4\n')
+                return changed
+
+            with open('yedit_test.yml', 'w') as yfd:
+                yfd.write('a: 1\n')
+            with mock.patch.object(Yedit, '_write', side_effect=racing_write):
+                Yedit.run_ansible(params)
+            self.assertEqual(Yedit.run_ansible(params)['journal'], 'miss')
+            self.assertEqual(Yedit('yedit_test.yml').get('a'), 2)
+
+            params['append'] = True
+            params['key'] = 'b'
+            Yedit.run_ansible(params)
+            self.assertNotIn('journal', Yedit.run_ansible(params))
+            self.assertEqual(Yedit('yedit_test.yml').get('b'), [2, 2])
+        finally:
+            os.unlink('yedit_test.yml.yedit_journal')
+
+    def test_run_ansible_expected_checksum(self):
+        '''test edits are only made on the expected version of the file'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: 1\n')
+        params = {'src': 'yedit_test.yml', 'state': 'present', 'key': 'a', 'value': 2, 'value_type': '',
+                  'update': False, 'append': False, 'insert': False, 'backup': False, 'backup_ext': '',
+                  'content': None, 'content_type': 'yaml', 'separator': '.', 'edits': None,
+                  'expected_checksum': Yedit.checksum('yedit_test.yml')}
+
+        results = Yedit.run_ansible(params)
+        self.assertTrue(results['changed'])
+        self.assertEqual(results['checksum'], Yedit.checksum('yedit_test.yml'))
+
+        params['value'] = 3
+        results = Yedit.run_ansible(params)
+        self.assertTrue(results['failed'])
+        self.assertEqual(Yedit('yedit_test.yml').get('a'), 2)
+
+        # the file replaced after it was first loaded is not edited
+        params['expected_checksum'] = Yedit.checksum('yedit_test.yml')
+        load = Yedit.load
+
+        def racing_load(yed, *args, **kwargs):
+            '''replace the file before the run loads it'''
+            if yed.yaml_dict is not None:
+                with open('yedit_test.yml', 'w') as yfd:
+                    yfd.write('a: 4\n')
+            return load(yed, *args, **kwargs)
+
+        with mock.patch.object(Yedit, 'load', autospec=True, side_effect=racing_load):
+            results = Yedit.run_ansible(params)
+        self.assertTrue(results['failed'])
+        self.assertEqual(results['checksum'], Yedit.checksum('yedit_test.yml'))
+        self.assertEqual(Yedit('yedit_test.yml').get('a'), 4)
+
+    def test_run_ansible_retries_conflicts(self):
+        '''test edits are applied again when another writer replaced the file'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: 1\n')
+        params = {'src': 'yedit_test.yml', 'state': 'present', 'key': 'b', 'value': 2, 'value_type': '',
+                  'update': False, 'append': False, 'insert': False, 'backup': False, 'backup_ext': '',
+                  'content': None, 'content_type': 'yaml', 'separator': '.', 'edits': None}
+
+        write = Yedit._write
+        concurrent = []
+
+        def racing_write(*args, **kwargs):
+            '''let another writer in before the first write'''
+            if not concurrent:
+                concurrent.append(Yedit('yedit_test.yml'))
+                concurrent[0].put('c', 3)
+                concurrent[0].write()
+            return write(*args, **kwargs)
+
+        with mock.patch.object(Yedit, '_write', side_effect=racing_write), \
+                mock.patch('yedit.time.sleep') as mock_sleep:
+            results = Yedit.run_ansible(params)
+
+        self.assertTrue(results['changed'])
+        self.assertEqual(results['conflicts'], 1)
+        # the retry holds the lock of the file instead of backing off
+        self.assertFalse(mock_sleep.called)
+        self.assertFalse(YeditLock._held)
+        self.assertEqual(Yedit('yedit_test.yml').yaml_dict, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(glob.glob('yedit_test.yml.yedit*'), [])
+
+    def test_run_ansible_lock(self):
+        '''test the run holds the lock of src and waits for it'''
+        with open('yedit_test.yml', 'w') as yfd:
+            yfd.write('a: 1\n')
+        params = {'src': 'yedit_test.yml', 'state': 'present', 'key': 'a', 'value': 2, 'value_type': '',
+                  'update': False, 'append': False, 'insert': False, 'backup': False, 'backup_ext': '',
+                  'content': None, 'content_type': 'yaml', 'separator': '.', 'edits': None,
+                  'lock': True, 'lock_timeout': 0.05}
+        try:
+            with open('yedit_test.yml.yedit_lock', 'w') as lfd:
+                fcntl.flock(lfd, fcntl.LOCK_EX)
+                results = Yedit.run_ansible(params)
+            self.assertTrue(results['failed'])
+            self.assertGreater(results['lock']['attempts'], 1)
+            self.assertEqual(Yedit('yedit_test.yml').get('a'), 1)
+
+            results = Yedit.run_ansible(params)
+            self.assertTrue(results['changed'])
+            self.assertEqual(results['lock']['attempts'], 1)
+            self.assertEqual(Yedit('yedit_test.yml').get('a'), 2)
+        finally:
+            os.unlink('yedit_test.yml.yedit_lock')
+
+        params['src'] = 'yedit_missing/yedit_test.yml'
+        results = Yedit.run_ansible(params)
+        self.assertTrue(results['failed'])
+        self.assertIn('yedit_missing/yedit_test.yml.yedit_lock', results['msg'])
+
+    def test_write_waits_for_target_lock(self):
+        '''test a write gives up on a file another writer holds'''
+        yed = Yedit('yedit_test.yml')
+        yed.put('a', 'changed')
+        with open('yedit_test.yml') as lfd, mock.patch.object(YeditLock, 'default_timeout', 0.05):
+            fcntl.flock(lfd, fcntl.LOCK_EX)
+            with self.assertRaises(YeditException):
+                yed.write()
+        self.assertEqual(Yedit('yedit_test.yml').get('a'), 'a')
+        self.assertEqual(glob.glob('yedit_test.yml.yedit*'), [])
+        self.assertTrue(yed.write()[0])
+
+    def test_keyed_selectors(self):
+        '''test selecting list items by the value of a field'''
+        yed = Yedit(content={'spec': {'containers': [{'name': 'side', 'image': 'a'},
+                                                     {'name': 'app', 'image': 'b', 'port': 80}]}})
+        self.assertEqual(Yedit.compile_key('spec.containers[name=app].image'),
+                         ('spec', 'containers', ('name', 'app'), 'image'))
+        self.assertEqual(yed.get('spec.containers[name=app].image'), 'b')
+        self.assertEqual(yed.get('spec.containers[port=80].name'), 'app')
+        self.assertEqual(Yedit.get_entry(yed.yaml_dict, 'spec.containers[name=side].image'), 'a')
+        self.assertIsNone(yed.get('spec.containers[name=none].image'))
+
+        self.assertTrue(yed.put('spec.containers[name=app].image', 'c')[0])
+        self.assertEqual(yed.get('spec.containers[1].image'), 'c')
+        self.assertTrue(yed.insert('spec.containers', {'name': 'init'}, 0)[0])
+        self.assertEqual(yed.get('spec.containers[name=app].image'), 'c')
+        self.assertTrue(yed.put('spec.containers[name=init].name', 'first')[0])
+        self.assertIsNone(yed.get('spec.containers[name=init]'))
+        self.assertEqual(yed.get('spec.containers[name=first]'), {'name': 'first'})
+
+        self.assertTrue(yed.delete('spec.containers[name=side]')[0])
+        self.assertEqual([item['name'] for item in yed.get('spec.containers')], ['first', 'app'])
+        self.assertFalse(yed.delete('spec.containers[name=side]')[0])
+        with self.assertRaises(YeditException):
+            yed.put('spec.containers[name=side].image', 'd')
+        self.assertEqual(yed.changed_paths(), ['spec.containers'])
+
+        yed = Yedit(content='rules:\n- {name: a, enabled: false, weight: 2.50, owner: x}\n'
+                            '- {name: b, enabled: true, weight: 1.0, owner: null}\n- {name: c, enabled: "true"}\n')
+        for selector, name in [('enabled=true', 'b'), ('enabled=True', 'b'), ('enabled=false', 'a'),
+                               ('owner=null', 'b'), ('owner=~', 'b'), ('weight=1.0', 'b'), ('weight=1', 'b'),
+                               ('weight=2.5', 'a'), ('weight=2.50', 'a')]:
+            self.assertEqual(yed.get('rules[{0}].name'.format(selector)), name)
+            self.assertEqual(Yedit.get_entry(yed.yaml_dict, 'rules[{0}].name'.format(selector)), name)
+
+    def test_list_membership_index(self):
+        '''test list lookups follow edits made after the index is built'''
+        yed = Yedit(content={'a': [1, {'b': 2}, 'c'], 'alias': None})
+        yed.yaml_dict['alias'] = yed.yaml_dict['a'][1]
+        self.assertTrue(yed.exists('a', {'b': 2}))
+        self.assertTrue(yed.exists('a', 1.0))
+        self.assertFalse(yed.exists('a', 'd'))
+
+        yed.append('a', 'd')
+        yed.insert('a', 'e', 0)
+        self.assertTrue(yed.exists('a', 'd'))
+        self.assertTrue(yed.update('a', 'f', curr_value='c')[0])
+        self.assertFalse(yed.exists('a', 'c'))
+        self.assertTrue(yed.pop('a', 'e')[0])
+        self.assertFalse(yed.pop('a', 'e')[0])
+        self.assertFalse(yed.update('a', 'd')[0])
+
+        # changed through the alias, not through the list
+        yed.put('alias.b', 3)
+        self.assertFalse(yed.exists('a', {'b': 2}))
+        self.assertTrue(yed.exists('a', {'b': 3}))
+        self.assertTrue(yed.pop('a', {'b': 3})[0])
+        self.assertEqual(yed.get('a'), [1, 'f', 'd'])
+
+        yed = Yedit(content=['a', 'b'])
+        self.assertTrue(yed.exists('', 'b'))
+        self.assertTrue(yed.delete('', value='a')[0])
+        self.assertFalse(yed.delete('', value='a')[0])
+        self.assertEqual(yed.yaml_dict, ['b'])
+
+    def test_bulk_list_edits(self):
+        '''test extend, extend_unique and remove_many'''
+        yed = Yedit(content={'allow': ['a', 'b']})
+        self.assertTrue(yed.extend('allow', ['c', 'a'])[0])
+        self.assertEqual(yed.get('allow'), ['a', 'b', 'c', 'a'])
+        self.assertTrue(yed.extend_unique('allow', ['d', 'b', 'e', 'd'])[0])
+        self.assertEqual(yed.get('allow'), ['a', 'b', 'c', 'a', 'd', 'e'])
+        self.assertFalse(yed.extend_unique('allow', ['e', 'a'])[0])
+        self.assertTrue(yed.remove_many('allow', ['a', 'e', 'f'])[0])
+        self.assertEqual(yed.get('allow'), ['b', 'c', 'd'])
+        self.assertFalse(yed.remove_many('allow', ['a'])[0])
+        self.assertTrue(yed.exists('allow', 'd'))
+        self.assertFalse(yed.exists('allow', 'a'))
+        self.assertTrue(yed.extend_unique('deny', ['x'])[0])
+        self.assertEqual(yed.get('deny'), ['x'])
+        with self.assertRaises(YeditException):
+            yed.extend('allow', 'g')
+
+    def test_bulk_list_edits_compare_values(self):
+        '''test bulk list edits compare the values their digests match'''
+        yed = Yedit(content='a:\n- 1\n- {b: 2, c: [3]}\n- .nan\n- x\n')
+        # a CommentedMap item against a dict value, 1 against 1.0
+        self.assertIsNot(type(yed.get('a')[1]), dict)
+        self.assertFalse(yed.extend_unique('a', [1.0, {'c': [3.0], 'b': 2}])[0])
+
+        # nan digests match but nan is not equal to nan
+        self.assertTrue(yed.extend_unique('a', [float('nan')])[0])
+        self.assertEqual(len(yed.get('a')), 5)
+        self.assertTrue(yed.remove_many('a', [1.0, {'b': 2, 'c': [3]}, float('nan')])[0])
+        self.assertEqual(len(yed.get('a')), 3)
+        self.assertEqual(yed.get('a')[1], 'x')
+
+    def test_run_ansible_remove_many(self):
+        '''test removing list items through the module keeps comments'''
+        with open(YeditTest.filename, 'w') as yfd:
+            yfd.write('allow:\n- a  # first\n- b\n- c  # third\n')
+
+        params = {'src': YeditTest.filename, 'state': 'present', 'key': 'allow', 'value': ['a', 'b'],
+                  'value_type': '', 'update': False, 'append': False, 'insert': False, 'remove_many': True,
+                  'index': None, 'curr_value': None, 'curr_value_format': 'yaml', 'backup': False,
+                  'backup_ext': '', 'separator': '.', 'edits': None, 'content': None, 'content_type': 'yaml'}
+        results = Yedit.run_ansible(params)
+        self.assertTrue(results['changed'])
+        with open(YeditTest.filename) as yfd:
+            self.assertEqual(yfd.read(), 'allow:\n- c  # third\n')
+
+    def test_wildcard_keys(self):
+        '''test reading and putting keys with wildcards'''
+        yed = Yedit(content={'a': {'x': {'image': 'i1', 'sub': {'image': 'i2'}}, 'y': {'image': 'i3'}},
+                             'spec': {'containers': [{'name': 'app'}, {'name': 'side', 'image': 's'}]}})
+        self.assertEqual(Yedit.compile_key('a..image'), ('a', Yedit.any_depth, 'image'))
+        self.assertEqual(Yedit.compile_key('spec.containers[*].name'),
+                         ('spec', 'containers', Yedit.any_child, 'name'))
+        self.assertIsNone(Yedit.compile_key('a..'))
+        self.assertEqual(yed.get('a.*.image'), ['i1', 'i3'])
+        self.assertEqual(yed.get('..image'), ['i1', 'i2', 'i3', 's'])
+        self.assertEqual(yed.get('spec.containers[*].name'), ['app', 'side'])
+        self.assertEqual(yed.get('a.*.none'), [])
+
+        self.assertTrue(yed.put('spec.containers[*].image', 'img')[0])
+        self.assertEqual(yed.get('spec.containers[*].image'), ['img', 'img'])
+        self.assertFalse(yed.put('spec.containers[*].image', 'img')[0])
+        self.assertTrue(yed.put('a..image', {'tag': 1})[0])
+        self.assertEqual(yed.get('a.x'), {'image': {'tag': 1}, 'sub': {'image': {'tag': 1}}})
+        self.assertIsNot(yed.get('a.x.image'), yed.get('a.y.image'))
+        with self.assertRaises(YeditException):
+            yed.delete('a.*.image')
+
+    def test_run_ansible_wildcard_put(self):
+        '''test a wildcard put through the module writes every match'''
+        with open(YeditTest.filename, 'w') as yfd:
+            yfd.write('a:\n  x:\n    image: old  # pinned\n  y:\n    image: old\n')
+
+        params = {'src': YeditTest.filename, 'state': 'present', 'key': 'a.*.image', 'value': 'new',
+                  'value_type': '', 'update': False, 'append': False, 'insert': False, 'index': None,
+                  'curr_value': None, 'curr_value_format': 'yaml', 'backup': False, 'backup_ext': '',
+                  'separator': '.', 'edits': None, 'content': None, 'content_type': 'yaml'}
+        results = Yedit.run_ansible(params)
+        self.assertTrue(results['changed'])
+        self.assertEqual(results['changed_paths'], ['a.x.image', 'a.y.image'])
+        with open(YeditTest.filename) as yfd:
+            self.assertEqual(yfd.read(), 'a:\n  x:\n    image: new  # pinned\n  y:\n    image: new\n')
+
+        params['state'] = 'list'
+        self.assertEqual(Yedit.run_ansible(params)['result'], ['new', 'new'])
+
+    def test_run_ansible_wildcard_list_engines(self):
+        '''test every engine lists the same matches of a wildcard key'''
+        with open(YeditTest.filename, 'w') as yfd:
+            yfd.write('a:\n  x: {image: one}\n  y: {image: two}\nb: 3\n')
+
+        params = {'src': YeditTest.filename, 'state': 'list', 'content': None, 'content_type': 'yaml',
+                  'separator': '.', 'backup': False, 'backup_ext': ''}
+        try:
+            for key, expected in [('a.*.image', ['one', 'two']), ('a..image', ['one', 'two']), ('b.*', []),
+                                  ('missing.*.image', []), ('missing..image', []), ('a.*.missing', [])]:
+                params['key'] = key
+                for options in [{'path_index': True}, {}, {'preserve_format': False}, {'document': '0'}]:
+                    results = Yedit.run_ansible(dict(params, **options))
+                    self.assertEqual(results['result'], expected, (key, options, results.get('engine')))
+        finally:
+            os.unlink(YeditTest.filename + '.yedit_index')
+
+    def test_query(self):
+        '''test projections, filters, slices and multi-selects of queries'''
+        data = {'rules': [{'name': 'a', 'port': 80, 'cidrs': ['x', 'y']},
+                          {'name': 'b', 'port': 443, 'cidrs': ['z']},
+                          {'name': 'c', 'port': 8080, 'cidrs': []}],
+                'zones': {'eu': {'size': 1}, 'us': {'size': 2}}}
+        self.assertEqual(YeditQuery.compile('rules[*].name').search(data), ['a', 'b', 'c'])
+        self.assertEqual(YeditQuery.compile('rules[?port > `100` && cidrs].name').search(data), ['b'])
+        self.assertEqual(YeditQuery.compile("rules[?name == 'c'] | [0].port").search(data), 8080)
+        self.assertEqual(YeditQuery.compile('rules[:2].cidrs[]').search(data), ['x', 'y', 'z'])
+        self.assertEqual(YeditQuery.compile('rules[-1].{n: name, p: port}').search(data), {'n': 'c', 'p': 8080})
+        self.assertEqual(YeditQuery.compile('zones.*.size').search(data), [1, 2])
+        self.assertEqual(YeditQuery.compile('[rules[0].name, missing]').search(data), ['a', None])
+        self.assertIs(YeditQuery.compile('zones.*.size'), YeditQuery.compile('zones.*.size'))
+        for query in ['rules[', 'rules[?port >]', 'length(rules)', '`{bad`']:
+            with self.assertRaises(YeditException):
+                YeditQuery.compile(query)
+
+    def test_run_ansible_list_query(self):
+        '''test state=list returns only the result of the query'''
+        with open(YeditTest.filename, 'w') as yfd:
+            yfd.write('spec:\n  containers:\n  - name: app\n    ports: [80]\n  - name: side\n')
+
+        params = {'src': YeditTest.filename, 'state': 'list', 'key': 'spec.containers', 'query': '[?ports].name',
+                  'value': None, 'value_type': '', 'update': False, 'append': False, 'insert': False,
+                  'index': None, 'curr_value': None, 'curr_value_format': 'yaml', 'backup': False,
+                  'backup_ext': '', 'separator': '.', 'edits': None, 'content': None, 'content_type': 'yaml'}
+        self.assertEqual(Yedit.run_ansible(params)['result'], ['app'])
+        params['key'] = ''
+        params['query'] = 'spec.containers[*].name'
+        self.assertEqual(Yedit.run_ansible(params)['result'], ['app', 'side'])
+        params['query'] = 'spec.containers[?'
+        self.assertTrue(Yedit.run_ansible(params)['failed'])
+
     def tearDown(self):
         '''TearDown method'''
         os.unlink(YeditTest.filename)